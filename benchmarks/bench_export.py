@@ -0,0 +1,103 @@
+"""Measure ost_export on a synthetic OST file.
+
+Usage: python benchmarks/bench_export.py [--shape shape.json] [--formats mbox eml]
+                                         [--repeat N] [-- extra ost_export arguments]
+
+Every run exports the folder tree of benchmarks/fake_pypff.py (see
+``fake_pypff.DEFAULT_SHAPE`` for the shape keys) in a fresh process and
+reports messages/s, output MB/s and the peak RSS of the process and its
+workers. Arguments after ``--`` are passed to ost_export, for example
+``-- --jobs 4`` or ``-- --html-to-text bs4``.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir))
+
+import fake_pypff
+
+
+def run_export(shape_path, output_dir: str, format: str, extra_args: list) -> dict:
+    """Run one export in this process and return its measurements."""
+    fake_pypff.install()
+    import logging
+    import ost_export
+
+    logging.getLogger('ost_export').setLevel(logging.WARNING)
+    start = time.perf_counter()
+    ost_export.main([shape_path or 'default', output_dir, format] + extra_args)
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {'elapsed': elapsed, 'peak_rss_kb': peak_rss}
+
+
+def directory_size(path: str) -> int:
+    """Return the total size of the files below ``path``."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+def measure(shape_path, format: str, extra_args: list) -> dict:
+    """Run one export in a child process and return its measurements."""
+    output_dir = tempfile.mkdtemp(prefix='ost_export_bench-')
+    try:
+        command = [sys.executable, os.path.abspath(__file__), '--child', format, output_dir]
+        if shape_path:
+            command += ['--shape', shape_path]
+        result = subprocess.run(command + ['--'] + extra_args, check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True)
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        stats['output_bytes'] = directory_size(output_dir)
+        return stats
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def main():
+    argv = sys.argv[1:]
+    extra_args = []
+    if '--' in argv:
+        extra_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shape', help="JSON file overriding fake_pypff.DEFAULT_SHAPE")
+    parser.add_argument('--formats', nargs='+', default=['mbox', 'eml'], choices=['mbox', 'eml', 'maildir'])
+    parser.add_argument('--repeat', type=int, default=1, help="runs per format; the fastest is reported")
+    parser.add_argument('--child', nargs=2, metavar=('FORMAT', 'OUTPUT_DIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        format, output_dir = args.child
+        print(json.dumps(run_export(args.shape, output_dir, format, extra_args)))
+        return
+
+    messages = fake_pypff.count_messages(args.shape)
+    print(f"{messages} messages, ost_export arguments: {' '.join(extra_args) or '(none)'}")
+    print(f"{'format':<8} {'seconds':>9} {'msg/s':>10} {'MB/s':>8} {'output MB':>10} {'peak RSS MB':>12}")
+    for format in args.formats:
+        runs = [measure(args.shape, format, extra_args) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run['elapsed'])
+        output_mb = best['output_bytes'] / (1024 * 1024)
+        print(f"{format:<8} {best['elapsed']:>9.2f} {messages / best['elapsed']:>10.1f} "
+              f"{output_mb / best['elapsed']:>8.2f} {output_mb:>10.1f} "
+              f"{max(run['peak_rss_kb'] for run in runs) / 1024:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
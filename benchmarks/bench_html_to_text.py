@@ -0,0 +1,66 @@
+"""Compare the throughput of the HTML-to-text converters of ost_export.
+
+Usage: python benchmarks/bench_html_to_text.py [--messages N] [--rows N]
+
+The input is a newsletter-like HTML document (nested tables, inline styles,
+links, images, a style and a script block). Every available converter is run
+on it and the messages/s and MB/s are reported.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import ost_export
+
+
+def make_newsletter(rows: int) -> str:
+    """Build an HTML newsletter with the given number of table rows."""
+    items = ''.join(
+        f'<tr><td style="padding:8px;font-family:Arial"><a href="https://example.com/item/{i}">'
+        f'Article {i} &amp; more</a><p>Lorem ipsum dolor sit amet, consectetur adipiscing elit '
+        f'&mdash; item {i}.</p></td><td><img src="https://example.com/{i}.png" alt="img {i}"/></td></tr>'
+        for i in range(rows))
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Newsletter</title>'
+        '<style>td { color: #333; } a { color: #06c; }</style></head>'
+        '<body><!-- header --><table width="100%">'
+        f'{items}</table><script>var tracking = "<p>ignored</p>";</script>'
+        '<p>Unsubscribe&nbsp;here</p></body></html>')
+
+
+def bench(converter, html: str, messages: int) -> float:
+    """Return the seconds needed to convert ``html`` ``messages`` times."""
+    start = time.perf_counter()
+    for _ in range(messages):
+        converter(html)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200, help="conversions per converter (default: 200)")
+    parser.add_argument('--rows', type=int, default=100, help="table rows in the newsletter (default: 100)")
+    args = parser.parse_args()
+
+    html = make_newsletter(args.rows)
+    size_mb = len(html.encode('utf-8')) * args.messages / (1024 * 1024)
+    available = ost_export.available_html_to_text_converters()
+    reference = ost_export.html_to_text_bs4(html) if 'bs4' in available else None
+
+    print(f"{len(html)} characters per message, {args.messages} messages")
+    print(f"{'converter':<10} {'msg/s':>10} {'MB/s':>10}  same as bs4")
+    for name in available:
+        converter = ost_export.HTML_TO_TEXT_CONVERTERS[name]
+        if converter is None:
+            continue
+        text = converter(html)
+        elapsed = bench(converter, html, args.messages)
+        same = '' if reference is None else ('yes' if text == reference else 'no')
+        print(f"{name:<10} {args.messages / elapsed:>10.1f} {size_mb / elapsed:>10.2f}  {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""Synthetic stand-in for the pypff module.
+
+It generates a folder tree of configurable shape, with messages, bodies and
+attachments created on the fly from a seed, so ost_export can be measured
+without a real OST file. Nothing is kept in memory besides the folder tree:
+message objects and attachment data are rebuilt every time they are read.
+
+Use ``install()`` before importing ost_export, then pass the path of a JSON
+shape file (or any path, for the default shape) as the OST file::
+
+    import fake_pypff
+    fake_pypff.install()
+    import ost_export
+    ost_export.export_ost('shape.json', 'out', 'mbox')
+
+The shape keys and their defaults are listed in ``DEFAULT_SHAPE``. Values
+given as ``[low, high]`` are drawn uniformly from that range for every item.
+"""
+import datetime
+import hashlib
+import json
+import os
+import random
+import sys
+
+DEFAULT_SHAPE = {
+    'seed': 1,
+    # Folder tree: every folder has `fanout` subfolders down to `depth` levels
+    'depth': 2,
+    'fanout': 3,
+    # Messages per folder
+    'messages': [20, 80],
+    # Share of messages with an HTML body; the others only have a plain body
+    'html_ratio': 0.7,
+    'html_size': [2000, 30000],
+    'plain_size': [500, 5000],
+    # Attachments per message and size of each attachment in bytes
+    'attachments': [0, 2],
+    'attachment_size': [10000, 500000],
+    # Number of distinct attachments shared by all messages, as with logos and
+    # documents sent around many times; 0 makes every attachment unique
+    'attachment_pool': 0,
+    # Share of messages that are copies of messages found in other folders,
+    # drawn from a pool of `duplicate_pool` messages
+    'duplicate_ratio': 0.0,
+    'duplicate_pool': 100,
+}
+
+_EXTENSIONS = ['pdf', 'docx', 'xlsx', 'png', 'jpg', 'zip', 'txt', 'csv']
+
+_WORDS = ('status report meeting budget review project update quarterly team '
+          'schedule deadline invoice contract proposal feedback release').split()
+
+
+def load_shape(path=None) -> dict:
+    """Return the default shape updated with the JSON file at ``path``, if any."""
+    shape = dict(DEFAULT_SHAPE)
+    if path and os.path.isfile(path):
+        with open(path) as f:
+            shape.update(json.load(f))
+    return shape
+
+
+def _draw(rng, value):
+    """Draw an integer from ``value``, a number or a ``[low, high]`` range."""
+    if isinstance(value, (list, tuple)):
+        return rng.randint(int(value[0]), int(value[1]))
+    return int(value)
+
+
+def _text(rng, size: int) -> str:
+    """Return roughly ``size`` characters of words."""
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def _message_identifier(folder_seed: str, index: int) -> int:
+    """Return the identifier of a message, unique in the file as in an OST file."""
+    return int(hashlib.md5(f"{folder_seed}/{index}".encode()).hexdigest()[:12], 16)
+
+
+class error(Exception):
+    pass
+
+
+class attachment:
+    """Attachment whose content is derived from a seed instead of stored."""
+
+    _BLOCK_SIZE = 4096
+
+    def __init__(self, seed: str, name: str, size: int):
+        self.name = name
+        self.size = size
+        self.identifier = int(hashlib.md5(seed.encode()).hexdigest()[:8], 16)
+        self._block = hashlib.sha256(seed.encode()).digest() * (self._BLOCK_SIZE // 32)
+        if name.endswith('.pdf'):
+            self._block = b'%PDF-1.4\n' + self._block[9:]
+        self._offset = 0
+
+    def get_name(self):
+        return self.name
+
+    def seek_offset(self, offset: int, whence: int = 0):
+        self._offset = offset if whence == 0 else self._offset + offset
+
+    def read_buffer(self, size: int) -> bytes:
+        size = max(0, min(size, self.size - self._offset))
+        start = self._offset % self._BLOCK_SIZE
+        repeats = (start + size) // self._BLOCK_SIZE + 1
+        data = (self._block * repeats)[start:start + size]
+        self._offset += size
+        return data
+
+
+class message:
+    """Message generated from the folder seed and its index."""
+
+    def __init__(self, shape: dict, folder_seed: str, index: int):
+        rng = random.Random(f"{folder_seed}/{index}")
+        self.identifier = _message_identifier(folder_seed, index)
+        self.subject = f"{rng.choice(['', 'RE: ', 'FW: '])}{_text(rng, 30)}"
+        self.sender_name = f"user{rng.randint(1, 200)}@example.com"
+        self.display_to = f"user{rng.randint(1, 200)}@example.com"
+        self.display_cc = ''
+        self.delivery_time = datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=rng.randint(0, 2000000))
+
+        plain = _text(rng, _draw(rng, shape['plain_size']))
+        self.plain_text_body = plain.encode('utf-8')
+        self.html_body = None
+        if rng.random() < shape['html_ratio']:
+            paragraphs = ''.join(f'<p style="margin:0">{_text(rng, 200)}</p>'
+                                 for _ in range(max(1, _draw(rng, shape['html_size']) // 240)))
+            self.html_body = (f'<html><head><style>p {{ color: #333; }}</style></head>'
+                              f'<body><table><tr><td>{paragraphs}</td></tr></table></body></html>').encode('utf-8')
+
+        self.attachments = []
+        for i in range(_draw(rng, shape['attachments'])):
+            if shape['attachment_pool']:
+                # Same seed, name and size for every copy of a pooled attachment
+                seed = f"pool/{rng.randrange(shape['attachment_pool'])}"
+                pool_rng = random.Random(seed)
+                name = f"{seed.replace('/', '_')}.{pool_rng.choice(_EXTENSIONS)}"
+                self.attachments.append(attachment(seed, name, _draw(pool_rng, shape['attachment_size'])))
+                continue
+            extension = rng.choice(_EXTENSIONS)
+            self.attachments.append(attachment(f"{folder_seed}/{index}/{i}", f"file{index}_{i}.{extension}",
+                                               _draw(rng, shape['attachment_size'])))
+
+    @property
+    def number_of_attachments(self):
+        return len(self.attachments)
+
+
+class folder:
+    """Folder of the synthetic tree; messages are built when requested."""
+
+    def __init__(self, shape: dict, name: str, seed: str, level: int):
+        rng = random.Random(seed)
+        self.name = name
+        self.identifier = int(hashlib.md5(seed.encode()).hexdigest()[:8], 16)
+        self._shape = shape
+        self._seed = seed
+        self._count = _draw(rng, shape['messages']) if level > 0 else 0
+        self.sub_folders = []
+        if level < shape['depth']:
+            self.sub_folders = [folder(shape, f"{name if level else 'Folder'}_{i}", f"{seed}/{i}", level + 1)
+                                for i in range(shape['fanout'])]
+
+    def get_name(self):
+        return self.name
+
+    def get_number_of_sub_messages(self) -> int:
+        return self._count
+
+    def get_sub_message(self, index: int) -> message:
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        rng = random.Random(f"{self._seed}/copy/{index}")
+        if rng.random() < self._shape['duplicate_ratio']:
+            copy = message(self._shape, 'copies', rng.randrange(self._shape['duplicate_pool']))
+            # A copy has the same content but its own identifier
+            copy.identifier = _message_identifier(self._seed, index)
+            return copy
+        return message(self._shape, self._seed, index)
+
+    @property
+    def number_of_sub_messages(self) -> int:
+        return self._count
+
+
+class file:
+    """Stand-in for ``pypff.file``; ``open`` takes the path of a JSON shape file."""
+
+    ACCESS_READ = 0x01
+
+    def __init__(self):
+        self._root = None
+
+    def open(self, path, mode='r'):
+        shape = load_shape(path)
+        self._root = folder(shape, 'Root', str(shape['seed']), 0)
+
+    def close(self):
+        self._root = None
+
+    def get_root_folder(self) -> folder:
+        if self._root is None:
+            raise error("file is not open")
+        return self._root
+
+
+def count_messages(path=None) -> int:
+    """Return the total number of messages of the shape at ``path``."""
+    shape = load_shape(path)
+    root = folder(shape, 'Root', str(shape['seed']), 0)
+    total = 0
+    pending = [root]
+    while pending:
+        current = pending.pop()
+        total += current.get_number_of_sub_messages()
+        pending.extend(current.sub_folders)
+    return total
+
+
+def install():
+    """Make ``import pypff`` return this module."""
+    sys.modules['pypff'] = sys.modules[__name__]
@@ -1,20 +1,62 @@
 import os
 import sys
+import argparse
+import asyncio
+import calendar
+import concurrent.futures
+import fnmatch
+import functools
+import io
+import itertools
 import logging
+import multiprocessing
+import queue
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+import json
 import mimetypes
 import re
 import email
+import email.generator
+import email.message
+import base64
+import hashlib
+import random
+import uuid
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-from email.utils import formatdate
-from datetime import datetime
-from bs4 import BeautifulSoup
+from email.utils import formatdate, parseaddr, parsedate_to_datetime
+from datetime import datetime, timedelta, timezone
+from html import unescape
+from html.entities import html5 as HTML5_ENTITIES
+from html.parser import HTMLParser
 import pypff
 import traceback
 from typing import Optional
 
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Define pypff constants if they don't exist
 if not hasattr(pypff, 'file'):
     class PffFile:
@@ -26,14 +68,490 @@ if not hasattr(pypff, 'error'):
         pass
     pypff.error = PffError
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Messages are logged through this logger; only the command line entry
+# point configures the logging output
+logger = logging.getLogger(__name__)
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# asyncio.get_running_loop() is Python 3.7+; in a coroutine on 3.6 the event
+# loop of the thread is the running one
+_get_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+# Folders with more messages than this are split into several work units
+# when exporting with more than one job
+DEFAULT_CHUNK_SIZE = 5000
+
+# Write buffer used for MBOX output files
+DEFAULT_MBOX_BUFFER_SIZE = 1024 * 1024
+
+# Memory budget for reading a single attachment. Larger attachments are
+# read and base64-encoded in chunks of this size while the message is written
+DEFAULT_ATTACHMENT_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Bytes read up front from streamed attachments to detect their type
+ATTACHMENT_HEAD_SIZE = 100
+
+# Name of the checkpoint index kept in the output directory
+CHECKPOINT_FILENAME = '.ost_export_checkpoint.sqlite'
+
+# Exported messages recorded between two checkpoint commits
+CHECKPOINT_BATCH_SIZE = 1000
+
+# Estimated export cost of a message without attachments, in bytes of output,
+# used with a scan index to balance work units
+MESSAGE_COST_BYTES = 64 * 1024
+
+# Work units per job aimed for when a scan index is available
+UNITS_PER_JOB = 4
+
+# Compression methods: file name suffix and default level
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+DEFAULT_COMPRESSION_LEVELS = {'gzip': 6, 'zstd': 3}
+
+# Chunks queued for the background compression thread
+BACKGROUND_QUEUE_DEPTH = 8
+
+# Content types of attachments by file extension
+ATTACHMENT_MIME_TYPES = {
+    # Documents
+    'pdf': 'application/pdf',
+    'doc': 'application/msword',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xls': 'application/vnd.ms-excel',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'ppt': 'application/vnd.ms-powerpoint',
+    'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'txt': 'text/plain',
+    'rtf': 'application/rtf',
+    'csv': 'text/csv',
+    # Images
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+    'bmp': 'image/bmp',
+    'tiff': 'image/tiff',
+    'svg': 'image/svg+xml',
+    # Archives
+    'zip': 'application/zip',
+    'rar': 'application/x-rar-compressed',
+    '7z': 'application/x-7z-compressed',
+    'tar': 'application/x-tar',
+    'gz': 'application/gzip',
+    # Audio/Video
+    'mp3': 'audio/mpeg',
+    'wav': 'audio/wav',
+    'mp4': 'video/mp4',
+    'avi': 'video/x-msvideo',
+    'mov': 'video/quicktime',
+    'wmv': 'video/x-ms-wmv'
+}
+
+# Binary formats whose file name must keep its extension
+BINARY_ATTACHMENT_EXTENSIONS = frozenset(['pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'zip', 'rar', '7z'])
+
+# Office formats that get an explicit content type
+OFFICE_ATTACHMENT_EXTENSIONS = frozenset(['doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx'])
+
+# Line ending policies of the output files
+LINE_ENDINGS = {'lf': '\n', 'crlf': '\r\n'}
+
+# Default line endings of each output format
+DEFAULT_LINE_ENDINGS = {'mbox': 'crlf', 'eml': 'lf', 'maildir': 'lf'}
+
+# Directory of the attachment store, inside the output directory
+ATTACHMENT_STORE_DIRNAME = 'attachments'
+
+# Index of the exported messages used to find duplicates. In the checkpoint
+# database the records of parallel workers carry their work unit, like the
+# checkpoint records
+DUPLICATES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        fingerprint BLOB PRIMARY KEY,
+        folder_path TEXT NOT NULL,
+        output_path TEXT NOT NULL,
+        inode INTEGER,
+        unit TEXT
+    )"""
+
+# Layouts of the EML files of a folder: subject names in one directory, or
+# unique names in 256 hashed subdirectories or in YYYY/MM subdirectories
+EML_LAYOUTS = ('flat', 'hash', 'date')
+
+# Characters of the subject kept in the unique EML file names
+EML_SUBJECT_LENGTH = 60
+
+# Directories of a Maildir, and the host name part of its file names with '/'
+# and ':' escaped as the Maildir convention asks
+MAILDIR_SUBDIRS = ('tmp', 'new', 'cur')
+MAILDIR_HOSTNAME = socket.gethostname().replace('/', '\\057').replace(':', '\\072')
+
+# Full-text index of the exported messages, in the output directory, and the
+# number of messages added to it between two commits
+SEARCH_INDEX_FILENAME = 'search_index.sqlite'
+SEARCH_INDEX_BATCH_SIZE = 1000
+
+SEARCH_INDEX_SCHEMA = ("""
+    CREATE TABLE IF NOT EXISTS locations (
+        id INTEGER PRIMARY KEY,
+        folder_path TEXT NOT NULL,
+        message_id TEXT NOT NULL,
+        delivery_time TEXT NOT NULL,
+        output_path TEXT NOT NULL,
+        offset INTEGER,
+        length INTEGER,
+        unit TEXT,
+        UNIQUE (folder_path, message_id, delivery_time)
+    )""", """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(subject, sender, recipients, body, attachments)""")
+
+# Files exported by the batch mode, and the memory assumed for the export of
+# one of them: a fixed part plus a share of the size of the file
+OST_EXTENSIONS = ('.ost', '.pst')
+BATCH_BASE_MEMORY = 256 * 1024 * 1024
+BATCH_MEMORY_RATIO = 0.25
+BATCH_REPORT_FILENAME = 'batch_report.json'
+
+# Actions for messages already exported from another folder
+DEDUP_MODES = ('skip', 'link')
+
+# Per-process OST handle and checkpoint store used by the parallel export workers
+_worker_ost_file = None
+_worker_checkpoint = None
+_worker_duplicates = None
+_worker_output_dir = None
+_worker_search_index = None
+
+class OstExportError(Exception):
+    """Raised when an OST file cannot be read or exported."""
+
+class MessageFilter:
+    """Select the folders and messages to export.
+
+    Folder patterns are shell globs matched, ignoring case, against the folder
+    path (``Top/Inbox/Projects``); ``*`` also matches ``/``. An excluded folder
+    is skipped with all its subfolders. With include patterns only the messages
+    of matching folders are exported, but subfolders of other folders are
+    still visited.
+
+    Messages are matched on properties that pypff reads from the message
+    record: delivery time in ``[since, before)``, sender and subject regular
+    expressions (searched, ignoring case), and the size of the attachments.
+    Bodies and attachment data are never read.
+    """
+
+    def __init__(self, include_folders: Optional[list] = None, exclude_folders: Optional[list] = None,
+                 since: Optional[datetime] = None, before: Optional[datetime] = None,
+                 sender: Optional[str] = None, subject: Optional[str] = None,
+                 max_attachment_size: Optional[int] = None):
+        self.include_folders = [pattern.lower() for pattern in include_folders or []]
+        self.exclude_folders = [pattern.lower() for pattern in exclude_folders or []]
+        self.since = since
+        self.before = before
+        self.sender = re.compile(sender, re.IGNORECASE) if sender else None
+        self.subject = re.compile(subject, re.IGNORECASE) if subject else None
+        self.max_attachment_size = max_attachment_size
+
+    def folder_excluded(self, folder_path: str) -> bool:
+        """Return True if the folder or one of its parents is excluded."""
+        if not self.exclude_folders:
+            return False
+        parts = folder_path.lower().split('/')
+        for depth in range(1, len(parts) + 1):
+            path = '/'.join(parts[:depth])
+            if any(fnmatch.fnmatchcase(path, pattern) for pattern in self.exclude_folders):
+                return True
+        return False
+
+    def folder_selected(self, folder_path: str) -> bool:
+        """Return True if the messages of the folder are to be exported."""
+        if self.folder_excluded(folder_path):
+            return False
+        path = folder_path.lower()
+        return not self.include_folders or any(fnmatch.fnmatchcase(path, pattern)
+                                               for pattern in self.include_folders)
+
+    def message_selected(self, message) -> bool:
+        """Return True if the message passes the message filters."""
+        if self.since is not None or self.before is not None:
+            delivery_time = getattr(message, 'delivery_time', None)
+            if delivery_time is None:
+                return False
+            if delivery_time.tzinfo is not None:
+                delivery_time = delivery_time.astimezone(timezone.utc).replace(tzinfo=None)
+            if self.since is not None and delivery_time < self.since:
+                return False
+            if self.before is not None and delivery_time >= self.before:
+                return False
+        if self.subject is not None and not self.subject.search(str(getattr(message, 'subject', '') or '')):
+            return False
+        if self.sender is not None:
+            values = (getattr(message, name, None) for name in ('sender_name', 'sender_email_address'))
+            sender = ' '.join(str(value) for value in values if value)
+            if not self.sender.search(sender):
+                return False
+        if self.max_attachment_size is not None:
+            for attachment in get_message_attachments(message):
+                if (getattr(attachment, 'size', 0) or 0) > self.max_attachment_size:
+                    return False
+        return True
+
+class ExportOptions:
+    """Settings shared by every folder of an export run.
+
+    The object is passed down from ``export_ost`` to ``process_folder`` and to
+    the parallel export workers, so it must stay picklable.
+    """
+
+    def __init__(self, mbox_buffer_size: int = DEFAULT_MBOX_BUFFER_SIZE,
+                 flush_every: int = 0, fsync: str = 'never',
+                 attachment_buffer_size: int = DEFAULT_ATTACHMENT_BUFFER_SIZE,
+                 checkpoint: bool = False, html_to_text: str = 'fast',
+                 compression: str = 'none', compression_level: Optional[int] = None,
+                 message_filter: Optional[MessageFilter] = None,
+                 line_endings: Optional[str] = None,
+                 attachment_store: Optional[str] = None,
+                 dedup_messages: Optional[str] = None,
+                 eml_layout: str = 'flat',
+                 search_index: bool = False):
+        self.mbox_buffer_size = mbox_buffer_size
+        self.flush_every = flush_every
+        self.fsync = fsync
+        self.attachment_buffer_size = attachment_buffer_size
+        self.checkpoint = checkpoint
+        self.html_to_text = html_to_text
+        self.compression = compression
+        self.compression_level = compression_level
+        self.message_filter = message_filter
+        self.line_endings = line_endings
+        self.attachment_store = attachment_store
+        self.dedup_messages = dedup_messages
+        self.eml_layout = eml_layout
+        self.search_index = search_index
+
+    def linesep(self, format: str) -> str:
+        """Return the line separator of the output files of ``format``."""
+        return LINE_ENDINGS[self.line_endings or DEFAULT_LINE_ENDINGS[format]]
+
+class ExportMetrics:
+    """Time and byte counters for each stage of an export.
+
+    ``add`` sits on the hot path and only updates two dictionaries. Every
+    process has its own instance in ``METRICS``; the parallel export merges the
+    snapshots returned by its workers.
+    """
+
+    STAGES = ('pypff_read', 'body_decode', 'html_to_text', 'attachment_read',
+              'mime_serialize', 'disk_write', 'compress')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.bytes = dict.fromkeys(self.STAGES, 0)
+        self.counters = {'messages': 0, 'skipped': 0, 'filtered': 0, 'errors': 0, 'attachments': 0,
+                         'deduplicated': 0, 'duplicates': 0}
+
+    def add(self, stage: str, seconds: float, nbytes: int = 0):
+        self.seconds[stage] += seconds
+        self.bytes[stage] += nbytes
+
+    def count(self, counter: str, n: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def snapshot(self) -> dict:
+        return {'seconds': dict(self.seconds), 'bytes': dict(self.bytes), 'counters': dict(self.counters)}
+
+    def merge(self, snapshot: dict):
+        for stage, seconds in snapshot['seconds'].items():
+            self.add(stage, seconds, snapshot['bytes'].get(stage, 0))
+        for counter, n in snapshot['counters'].items():
+            self.count(counter, n)
+
+    def summary(self, elapsed: float) -> dict:
+        """Return the metrics of a run as a JSON-serializable dictionary."""
+        messages = self.counters['messages']
+        return {
+            'elapsed_seconds': round(elapsed, 3),
+            'messages_per_second': round(messages / elapsed, 2) if elapsed else None,
+            'bytes_written': self.bytes['disk_write'],
+            'counters': dict(self.counters),
+            'stages': {stage: {'seconds': round(self.seconds[stage], 3), 'bytes': self.bytes[stage]}
+                       for stage in self.STAGES},
+        }
+
+class ProgressReporter:
+    """Single status line with the exported message count, rate and ETA."""
+
+    def __init__(self, total: int, stream=None, interval: float = 1.0):
+        self.total = total
+        self.done = 0
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self._start = time.monotonic()
+        self._last = 0.0
+
+    def update(self, n: int = 1):
+        self.done += n
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            self._render(now)
+
+    def _render(self, now: float):
+        elapsed = now - self._start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        if rate > 0 and self.total >= self.done:
+            eta = int((self.total - self.done) / rate)
+            eta_text = f"{eta // 3600:d}:{eta % 3600 // 60:02d}:{eta % 60:02d}"
+        else:
+            eta_text = '-:--:--'
+        self.stream.write(f"\r{self.done}/{self.total} messages ({percent:.1f}%), "
+                          f"{rate:.1f} msg/s, ETA {eta_text} ")
+        self.stream.flush()
+
+    def finish(self):
+        self._render(time.monotonic())
+        self.stream.write('\n')
+        self.stream.flush()
+
+# Metrics of the current process
+METRICS = ExportMetrics()
+
+# Progress line of the running export, if enabled
+_progress = None
+
+def _report_progress(n: int = 1):
+    if _progress is not None:
+        _progress.update(n)
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collect the text of an HTML document in a single streaming pass.
+
+    The text nodes are the ones ``BeautifulSoup.get_text`` returns: adjacent
+    character data is merged, while comments and the content of script,
+    style and template elements are dropped. As in BeautifulSoup, a node of
+    whitespace only becomes a single newline or space outside pre and
+    textarea elements, and character references are resolved by the handlers
+    below, so an unknown or unterminated one is kept as text.
+    """
+
+    SKIPPED_TAGS = ('script', 'style', 'template')
+    PRESERVE_WHITESPACE_TAGS = ('pre', 'textarea')
+    ASCII_SPACES = ' \n\t\f\r'
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.parts = []
+        self._data = []
+        self._skip = 0
+        # Open pre and textarea elements
+        self._preserve = []
 
-def create_message(msg_obj, folder_name, output_format):
-    """Create an email message from a pypff message object with proper MIME structure."""
+    def flush(self):
+        if self._data:
+            if not self._skip:
+                data = ''.join(self._data)
+                if not self._preserve and not data.strip(self.ASCII_SPACES):
+                    data = '\n' if '\n' in data else ' '
+                self.parts.append(data)
+            self._data = []
+
+    def handle_starttag(self, tag, attrs):
+        self.flush()
+        if tag in self.SKIPPED_TAGS:
+            self._skip += 1
+        elif tag in self.PRESERVE_WHITESPACE_TAGS:
+            self._preserve.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.flush()
+
+    def handle_endtag(self, tag):
+        self.flush()
+        if tag in self.SKIPPED_TAGS and self._skip:
+            self._skip -= 1
+        elif tag in self._preserve:
+            # Also closes the elements opened inside it
+            del self._preserve[len(self._preserve) - self._preserve[::-1].index(tag) - 1:]
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_entityref(self, name):
+        self._data.append(HTML5_ENTITIES.get(name + ';', '&' + name))
+
+    def handle_charref(self, name):
+        self._data.append(unescape(f"&#{name};"))
+
+    def handle_comment(self, data):
+        self.flush()
+
+    def handle_decl(self, decl):
+        self.flush()
+
+    def handle_pi(self, data):
+        self.flush()
+
+    def unknown_decl(self, data):
+        self.flush()
+        if data.startswith('CDATA[') and not self._skip:
+            self.parts.append(data[6:])
+
+def html_to_text_fast(html: str) -> str:
+    """Convert HTML to plain text with the standard library HTML parser."""
+    extractor = _HTMLTextExtractor()
+    extractor.feed(html.replace('\r\n', '\n').replace('\r', '\n'))
+    extractor.close()
+    extractor.flush()
+    return '\n'.join(extractor.parts)
+
+def html_to_text_bs4(html: str) -> str:
+    """Convert HTML to plain text with BeautifulSoup."""
+    soup = BeautifulSoup(html, 'html.parser')
+    return soup.get_text('\n')
+
+def html_to_text_lxml(html: str) -> str:
+    """Convert HTML to plain text with lxml."""
+    root = lxml.html.document_fromstring(html)
+    return '\n'.join(root.xpath('//text()[not(ancestor::script or ancestor::style or ancestor::template)]'))
+
+# Converters available for the plain text alternative of HTML messages.
+# 'none' skips the plain text part entirely.
+HTML_TO_TEXT_CONVERTERS = {
+    'fast': html_to_text_fast,
+    'bs4': html_to_text_bs4,
+    'lxml': html_to_text_lxml,
+    'none': None,
+}
+
+def available_html_to_text_converters() -> list:
+    """Return the names of the converters whose dependencies are installed."""
+    names = ['fast']
+    if BeautifulSoup is not None:
+        names.append('bs4')
+    if lxml is not None:
+        names.append('lxml')
+    names.append('none')
+    return names
+
+def create_message(msg_obj, folder_name, output_format, options: Optional[ExportOptions] = None):
+    """Create an email message from a pypff message object with proper MIME structure.
+
+    The returned message also has a ``plain_text`` attribute, the text of its
+    body (None for HTML bodies without a converter, unless the options ask for
+    a search index), and ``attachment_names``, the file names of its
+    attachments.
+    """
+    options = options or ExportOptions()
+    started = time.perf_counter()
     try:
         # Create a multipart message that will contain the email
         msg = MIMEMultipart('mixed')
+        msg.plain_text = None
+        msg.attachment_names = []
         
         # Create a related part for the main content (can contain both text and HTML)
         msg_related = MIMEMultipart('related')
@@ -54,8 +572,10 @@ def create_message(msg_obj, folder_name, output_format):
         
         # Ensure proper MIME version
         msg['MIME-Version'] = '1.0'
+        METRICS.add('pypff_read', time.perf_counter() - started)
         
         # Add message body
+        started = time.perf_counter()
         try:
             # Try HTML body first
             if hasattr(msg_obj, 'html_body') and msg_obj.html_body:
@@ -65,7 +585,7 @@ def create_message(msg_obj, folder_name, output_format):
                         body = body.decode('utf-8', errors='replace')
                     body_type = 'html'
                 except Exception as e:
-                    logging.warning(f"Error processing HTML body: {e}")
+                    logger.warning(f"Error processing HTML body: {e}")
                     # Fall through to plain text
             
             # Try plain text body
@@ -77,29 +597,41 @@ def create_message(msg_obj, folder_name, output_format):
                             body = body.decode('utf-8', errors='replace')
                         body_type = 'plain'
                     except Exception as e:
-                        logging.warning(f"Error processing plain text body: {e}")
+                        logger.warning(f"Error processing plain text body: {e}")
             
             # If no body was added, add a placeholder
             if not hasattr(msg_obj, 'html_body') and not hasattr(msg_obj, 'plain_text_body'):
                 body = 'No message body found.'
                 body_type = 'plain'
             
+            METRICS.add('body_decode', time.perf_counter() - started, len(body))
+            
             # Add the body to the message as an alternative part
             alternative = MIMEMultipart('alternative')
             
             # Add plain text part
             if body_type == 'html':
                 # Try to extract plain text from HTML
-                try:
-                    soup = BeautifulSoup(body, 'html.parser')
-                    plain_text = soup.get_text('\n')
-                    alternative.attach(MIMEText(plain_text, 'plain', 'utf-8'))
-                except:
-                    # Fallback to HTML only if conversion fails
-                    pass
+                html_to_text = HTML_TO_TEXT_CONVERTERS.get(options.html_to_text)
+                if html_to_text is not None:
+                    try:
+                        started = time.perf_counter()
+                        plain_text = html_to_text(body)
+                        METRICS.add('html_to_text', time.perf_counter() - started, len(body))
+                        alternative.attach(MIMEText(plain_text, 'plain', 'utf-8'))
+                        msg.plain_text = plain_text
+                    except:
+                        # Fallback to HTML only if conversion fails
+                        pass
+                elif options.search_index:
+                    # Only for the search index, the message keeps the HTML part only
+                    started = time.perf_counter()
+                    msg.plain_text = html_to_text_fast(body)
+                    METRICS.add('html_to_text', time.perf_counter() - started, len(body))
                 alternative.attach(MIMEText(body, 'html', 'utf-8'))
             else:
                 alternative.attach(MIMEText(body, 'plain', 'utf-8'))
+                msg.plain_text = body
             
             # Add the alternative part to the related part
             msg_related.attach(alternative)
@@ -108,11 +640,14 @@ def create_message(msg_obj, folder_name, output_format):
             msg.attach(msg_related)
         
         except Exception as e:
-            logging.error(f"Error processing message body: {e}")
+            logger.error(f"Error processing message body: {e}")
             msg.attach(MIMEText('Error processing message body.', 'plain', 'utf-8'))
 
         # Process attachments
         try:
+            store = None
+            if options.attachment_store:
+                store = get_attachment_store(options.attachment_store, options.attachment_buffer_size)
             if hasattr(msg_obj, 'attachments') and msg_obj.attachments:
                 for attachment in msg_obj.attachments:
                     try:
@@ -120,66 +655,24 @@ def create_message(msg_obj, folder_name, output_format):
                         if not hasattr(attachment, 'read_buffer') or not hasattr(attachment, 'size'):
                             continue
                             
-                        # Read attachment data
-                        attach_data = attachment.read_buffer(attachment.size)
+                        attach_size = attachment.size
+                        if not attach_size:
+                            continue
+                        
+                        # Read attachment data. Attachments larger than the
+                        # buffer are streamed when the message is written, so
+                        # only their first bytes are needed here.
+                        streamed = attach_size > options.attachment_buffer_size and hasattr(attachment, 'seek_offset')
+                        started = time.perf_counter()
+                        if streamed:
+                            attach_data = attachment.read_buffer(ATTACHMENT_HEAD_SIZE)
+                        else:
+                            attach_data = attachment.read_buffer(attach_size)
+                        METRICS.add('attachment_read', time.perf_counter() - started, len(attach_data or b''))
                         if not attach_data:
                             continue
                             
-                        # Create MIME part
-                        part = MIMEBase('application', 'octet-stream')
-                        part.set_payload(attach_data)
-                        encoders.encode_base64(part)
-                        
-                        # Get filename and clean it
-                        filename = None
-                        if hasattr(attachment, 'name') and attachment.name:
-                            filename = attachment.name
-                        elif hasattr(attachment, 'get_name'):
-                            filename = attachment.get_name()
-                        
-                        # If no filename, create a generic one
-                        if not filename:
-                            filename = f"attachment_{getattr(attachment, 'identifier', 'unknown')}"
-                        
-                        # Clean filename and ensure it's a string
-                        filename = str(filename).strip()
-                        filename = "".join(c for c in filename if c.isprintable() and c not in '\\/*?:"<>|')
-                        
-                        # Common MIME types mapping
-                        mime_types = {
-                            # Documents
-                            'pdf': 'application/pdf',
-                            'doc': 'application/msword',
-                            'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                            'xls': 'application/vnd.ms-excel',
-                            'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                            'ppt': 'application/vnd.ms-powerpoint',
-                            'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-                            'txt': 'text/plain',
-                            'rtf': 'application/rtf',
-                            'csv': 'text/csv',
-                            # Images
-                            'png': 'image/png',
-                            'jpg': 'image/jpeg',
-                            'jpeg': 'image/jpeg',
-                            'gif': 'image/gif',
-                            'bmp': 'image/bmp',
-                            'tiff': 'image/tiff',
-                            'svg': 'image/svg+xml',
-                            # Archives
-                            'zip': 'application/zip',
-                            'rar': 'application/x-rar-compressed',
-                            '7z': 'application/x-7z-compressed',
-                            'tar': 'application/x-tar',
-                            'gz': 'application/gzip',
-                            # Audio/Video
-                            'mp3': 'audio/mpeg',
-                            'wav': 'audio/wav',
-                            'mp4': 'video/mp4',
-                            'avi': 'video/x-msvideo',
-                            'mov': 'video/quicktime',
-                            'wmv': 'video/x-ms-wmv'
-                        }
+                        filename = get_attachment_filename(attachment)
                         
                         # Get file extension
                         file_ext = ''
@@ -187,41 +680,56 @@ def create_message(msg_obj, folder_name, output_format):
                             file_ext = filename.rsplit('.', 1)[1].lower()
                         
                         # Determine content type
-                        content_type = mime_types.get(file_ext, 'application/octet-stream')
+                        content_type = ATTACHMENT_MIME_TYPES.get(file_ext, 'application/octet-stream')
                         
                         # Special handling for known binary formats
-                        if file_ext in ['pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'zip', 'rar', '7z']:
+                        if file_ext in BINARY_ATTACHMENT_EXTENSIONS:
                             if not filename.lower().endswith(f'.{file_ext}'):
                                 filename = f"{filename}.{file_ext}"
                         
                         # Debug: Print attachment info
-                        logging.info(f"Processing attachment: {filename}, Type: {content_type}, Size: {len(attach_data)} bytes")
+                        debug = logger.isEnabledFor(logging.DEBUG)
+                        if debug:
+                            logger.debug(f"Processing attachment: {filename}, Type: {content_type}, Size: {attach_size} bytes")
                         
                         # Special handling for PDFs - check magic number
                         if filename.lower().endswith('.pdf') or (len(attach_data) > 4 and attach_data.startswith(b'%PDF-')):
                             content_type = 'application/pdf'
                             if not filename.lower().endswith('.pdf'):
                                 filename += '.pdf'
-                            logging.info(f"Detected PDF file by content or extension: {filename}")
+                            if debug:
+                                logger.debug(f"Detected PDF file by content or extension: {filename}")
                         
                         # Create the MIME part with proper headers
                         maintype, subtype = content_type.split('/', 1) if '/' in content_type else ('application', 'octet-stream')
                         
                         # Additional debug for PDFs
-                        if content_type == 'application/pdf':
-                            logging.info(f"PDF content starts with: {attach_data[:100]}")
+                        if debug and content_type == 'application/pdf':
+                            logger.debug(f"PDF content starts with: {attach_data[:100]}")
                             # Try to extract PDF version number
                             pdf_header = attach_data[:8].decode('ascii', errors='ignore')
-                            logging.info(f"PDF header: {pdf_header}")
+                            logger.debug(f"PDF header: {pdf_header}")
                         
-                        if maintype == 'text':
+                        if store is not None:
+                            # Only a reference to the stored data goes into the message
+                            digest = store.add(attachment, attach_size, None if streamed else attach_data)
+                            msg.attach(store.external_body_part(digest, attach_size, content_type, filename))
+                            msg.attachment_names.append(filename)
+                            METRICS.count('attachments')
+                            continue
+                        
+                        if streamed:
+                            # Large files are base64-encoded chunk by chunk while writing
+                            part = StreamedAttachment(maintype, subtype, attachment, attach_size,
+                                                      options.attachment_buffer_size)
+                        elif maintype == 'text':
                             # For text files, use MIMEText to handle encoding
                             try:
                                 if isinstance(attach_data, bytes):
                                     attach_data = attach_data.decode('utf-8', errors='replace')
                                 part = MIMEText(attach_data, _subtype=subtype, _charset='utf-8')
                             except Exception as e:
-                                logging.warning(f"Error creating text part: {e}")
+                                logger.warning(f"Error creating text part: {e}")
                                 part = MIMEBase(maintype, subtype)
                                 part.set_payload(attach_data)
                         else:
@@ -238,32 +746,36 @@ def create_message(msg_obj, folder_name, output_format):
                             part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
                             part.add_header('Content-Transfer-Encoding', 'base64')
                             part.add_header('Content-Description', 'PDF Document')
-                            logging.info(f"Set explicit PDF headers for: {filename}")
+                            if debug:
+                                logger.debug(f"Set explicit PDF headers for: {filename}")
                         else:
                             # For other file types
                             part.add_header('Content-Type', f'{maintype}/{subtype}', name=filename)
                             part.add_header('Content-Disposition', 'attachment', filename=filename)
-                            part.add_header('Content-Transfer-Encoding', 'base64' if maintype != 'text' else '8bit')
+                            part.add_header('Content-Transfer-Encoding', 'base64' if maintype != 'text' or streamed else '8bit')
                         
                             # For known binary formats, ensure proper content type
-                            if file_ext in ['doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx']:
+                            if file_ext in OFFICE_ATTACHMENT_EXTENSIONS:
                                 part.set_type(content_type)
                                 part.add_header('Content-Type', content_type, name=filename)
-                                logging.info(f"Set explicit content type for {file_ext}: {content_type}")
+                                if debug:
+                                    logger.debug(f"Set explicit content type for {file_ext}: {content_type}")
                         msg.attach(part)
+                        msg.attachment_names.append(filename)
+                        METRICS.count('attachments')
                         
                     except Exception as e:
-                        logging.error(f"Error processing attachment: {e}")
+                        logger.error(f"Error processing attachment: {e}")
                         continue
                         
         except Exception as e:
-            logging.error(f"Error processing attachments: {e}")
+            logger.error(f"Error processing attachments: {e}")
 
         return msg
 
     except Exception as e:
-        logging.error(f"Error creating message: {e}")
-        logging.debug(traceback.format_exc())
+        logger.error(f"Error creating message: {e}")
+        logger.debug(traceback.format_exc())
         # Return a minimal valid message even if there was an error
         msg = MIMEMultipart()
         msg['From'] = "error@local"
@@ -272,196 +784,2658 @@ def create_message(msg_obj, folder_name, output_format):
         msg.attach(MIMEText(f'Error processing message: {str(e)}', 'plain', 'utf-8'))
         return msg
 
-def export_to_mbox(messages, output_file):
-    """Export messages to an MBOX file with proper formatting."""
-    # Ensure the output directory exists
-    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
-    
-    with open(output_file, 'ab') as mbox_file:
-        for msg in messages:
-            try:
-                # Ensure proper MIME structure
-                if not msg.is_multipart():
-                    # Convert to multipart if not already
-                    new_msg = MIMEMultipart()
-                    for key, value in msg.items():
-                        new_msg[key] = value
-                    new_msg.attach(MIMEText(msg.get_payload(), 'plain' if msg.get_content_type() == 'text/plain' else 'html'))
-                    msg = new_msg
-                
-                # Ensure proper headers for MBOX format
-                if 'From' not in msg:
-                    msg['From'] = 'unknown@example.com'
-                if 'Date' not in msg:
-                    msg['Date'] = datetime.now().strftime('%a, %d %b %Y %H:%M:%S %z')
-                if 'Message-ID' not in msg:
-                    msg['Message-ID'] = f"<{datetime.now().timestamp()}@{os.uname().nodename}>"
-                
-                # Add From_ line required by mbox format
-                from_line = f"From {msg['From']} {datetime.now().strftime('%a %b %d %H:%M:%S %Y')}\n"
-                mbox_file.write(from_line.encode('utf-8', errors='replace'))
-                
-                # Write the message with proper line endings
-                msg_str = msg.as_string()
-                # Ensure proper line endings for MBOX format
-                msg_str = msg_str.replace('\r\n', '\n').replace('\r', '\n').replace('\n', '\r\n')
-                mbox_file.write(msg_str.encode('utf-8', errors='replace'))
-                mbox_file.write(b'\r\n\r\n')  # Add separator between messages with proper line endings
-                
-            except Exception as e:
-                logging.error(f"Error exporting message to MBOX: {e}")
-                continue
+# Lines of a message body that would be read as an mbox message separator
+_MBOX_FROM_RE = re.compile(rb'^(>*From )', re.MULTILINE)
 
-def process_folder(folder, output_dir: str, format: str = 'mbox'):
-    """Process a folder and its subfolders."""
-    # Initialize folder_name with a default value
-    folder_name = "UnknownFolder"
-    safe_folder_name = folder_name
-    
+# Any line ending in a payload
+_NEWLINE_RE = re.compile(rb'\r\n|\r|\n')
+
+class StreamedAttachment(MIMEBase):
+    """A base64 attachment part whose data is read from pypff while writing.
+
+    The part has no payload of its own: ``write_message`` writes the
+    attachment data, read and encoded ``chunk_size`` bytes at a time, so the
+    memory used does not depend on the size of the attachment.
+    """
+
+    def __init__(self, maintype: str, subtype: str, attachment, size: int,
+                 chunk_size: int = DEFAULT_ATTACHMENT_BUFFER_SIZE, **params):
+        super().__init__(maintype, subtype, **params)
+        self.attachment = attachment
+        self.size = size
+        # Whole base64 lines are 57 input bytes, so chunks never split a line
+        self.chunk_size = max(57, chunk_size - chunk_size % 57)
+        self['Content-Transfer-Encoding'] = 'base64'
+        self.set_payload('')
+
+    def iter_encoded(self, linesep: bytes = b'\n'):
+        """Yield the base64 encoded attachment data in chunks."""
+        self.attachment.seek_offset(0)
+        remaining = self.size
+        while remaining > 0:
+            started = time.perf_counter()
+            chunk = self.attachment.read_buffer(min(self.chunk_size, remaining))
+            METRICS.add('attachment_read', time.perf_counter() - started, len(chunk or b''))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            started = time.perf_counter()
+            encoded = base64.encodebytes(chunk)
+            if linesep != b'\n':
+                encoded = encoded.replace(b'\n', linesep)
+            METRICS.add('mime_serialize', time.perf_counter() - started, len(encoded))
+            yield encoded
+
+class AttachmentStore:
+    """Content-addressed directory of attachment data.
+
+    Every distinct attachment is stored once, as ``<sha256[:2]>/<sha256>``,
+    and messages get a ``message/external-body`` part pointing to it. The
+    data has to be read to be hashed, but only new data is written. Data of
+    a size never seen before cannot be a duplicate, so it is hashed and
+    written in a single pass; otherwise it is hashed first and only read a
+    second time if it turns out to be new. Blobs are written to a temporary
+    file and renamed, so several processes can share a store.
+    """
+
+    def __init__(self, path: str, chunk_size: int = DEFAULT_ATTACHMENT_BUFFER_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._digests = set()
+        self._sizes = set()
+        os.makedirs(path, exist_ok=True)
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.path, digest[:2], digest)
+
+    def reference(self, digest: str) -> str:
+        """Return the path of a blob relative to the parent of the store."""
+        return '/'.join((os.path.basename(self.path.rstrip(os.sep)), digest[:2], digest))
+
+    def _exists(self, digest: str) -> bool:
+        if digest in self._digests or os.path.exists(self.blob_path(digest)):
+            self._digests.add(digest)
+            return True
+        return False
+
+    def _read_chunks(self, attachment, size: int):
+        attachment.seek_offset(0)
+        remaining = size
+        while remaining > 0:
+            started = time.perf_counter()
+            chunk = attachment.read_buffer(min(self.chunk_size, remaining))
+            METRICS.add('attachment_read', time.perf_counter() - started, len(chunk or b''))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def _write_blob(self, chunks) -> str:
+        """Write chunks to a temporary file while hashing them; return the digest."""
+        fd, temp_path = tempfile.mkstemp(prefix='.blob-', dir=self.path)
+        try:
+            sha256 = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in chunks:
+                    sha256.update(chunk)
+                    started = time.perf_counter()
+                    temp_file.write(chunk)
+                    METRICS.add('disk_write', time.perf_counter() - started, len(chunk))
+            digest = sha256.hexdigest()
+            if self._exists(digest):
+                os.remove(temp_path)
+                METRICS.count('deduplicated')
+            else:
+                os.makedirs(os.path.dirname(self.blob_path(digest)), exist_ok=True)
+                os.replace(temp_path, self.blob_path(digest))
+                self._digests.add(digest)
+            return digest
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def add(self, attachment, size: int, data: Optional[bytes] = None) -> str:
+        """Store the data of an attachment unless it is known; return its digest.
+
+        ``data`` is the whole attachment if it was already read, otherwise it
+        is read from ``attachment`` in chunks.
+        """
+        new_size = size not in self._sizes
+        self._sizes.add(size)
+        if data is not None:
+            digest = hashlib.sha256(data).hexdigest()
+            if self._exists(digest):
+                METRICS.count('deduplicated')
+                return digest
+            return self._write_blob([data])
+        if new_size:
+            return self._write_blob(self._read_chunks(attachment, size))
+        sha256 = hashlib.sha256()
+        for chunk in self._read_chunks(attachment, size):
+            sha256.update(chunk)
+        digest = sha256.hexdigest()
+        if self._exists(digest):
+            METRICS.count('deduplicated')
+            return digest
+        return self._write_blob(self._read_chunks(attachment, size))
+
+    def external_body_part(self, digest: str, size: int, content_type: str, filename: str) -> MIMEBase:
+        """Build the part of a message that refers to a stored attachment."""
+        part = MIMEBase('message', 'external-body', **{'access-type': 'local-file',
+                                                       'name': self.reference(digest), 'size': str(size)})
+        part.add_header('Content-Disposition', 'attachment', filename=filename)
+        # The body of an external-body part holds the headers of the data
+        inner = email.message.Message()
+        inner.add_header('Content-Type', content_type, name=filename)
+        inner.add_header('Content-Disposition', 'attachment', filename=filename)
+        inner['Content-Transfer-Encoding'] = 'binary'
+        inner['Content-ID'] = f"<{digest}@sha256>"
+        part.set_payload(inner.as_string())
+        return part
+
+# Attachment stores of this process, by path
+_attachment_stores = {}
+
+def get_attachment_store(path: str, chunk_size: int = DEFAULT_ATTACHMENT_BUFFER_SIZE) -> AttachmentStore:
+    """Return the attachment store of this process for ``path``."""
+    store = _attachment_stores.get(path)
+    if store is None:
+        store = _attachment_stores[path] = AttachmentStore(path, chunk_size)
+    return store
+
+class MessageWriter:
+    """Serialize email messages to a binary file one part at a time.
+
+    The output is the same as ``msg.as_string()`` with every line ending
+    turned into ``linesep``, but headers and payloads are encoded and written
+    part by part, so the whole message never exists as one string. Streamed
+    attachments are encoded while they are read. With ``escape_from`` body
+    lines starting with ``From `` are escaped as ``>From `` (mboxrd).
+    """
+
+    def __init__(self, fp, linesep: str = '\n', escape_from: bool = False):
+        self.fp = fp
+        self.linesep = linesep
+        self.escape_from = escape_from
+        self.written = 0
+        self._nl = linesep.encode('ascii')
+        # Data handed to a compressor or spooled for a zip entry is counted
+        # when it reaches the output file
+        self._on_disk = not isinstance(fp, (BackgroundWriter, tempfile.SpooledTemporaryFile))
+        # Headers are not folded, as with as_string()
+        self._policy = None
+
+    def write(self, msg) -> int:
+        """Write a message and return the number of bytes written."""
+        written = self.written
+        self._policy = msg.policy.clone(linesep=self.linesep, max_line_length=0)
+        self._write_part(msg)
+        return self.written - written
+
+    def _write(self, data: bytes):
+        if self._on_disk:
+            started = time.perf_counter()
+            self.fp.write(data)
+            METRICS.add('disk_write', time.perf_counter() - started, len(data))
+        else:
+            self.fp.write(data)
+        self.written += len(data)
+
+    def _encode_text(self, text: str) -> bytes:
+        """Encode a payload, normalizing its line endings and escaping From lines."""
+        started = time.perf_counter()
+        data = text.encode('utf-8', errors='replace')
+        if b'\r' in data:
+            data = _NEWLINE_RE.sub(self._nl, data)
+        elif self._nl != b'\n':
+            data = data.replace(b'\n', self._nl)
+        if self.escape_from and b'From ' in data:
+            data = _MBOX_FROM_RE.sub(rb'>\1', data)
+        METRICS.add('mime_serialize', time.perf_counter() - started, len(data))
+        return data
+
+    def _write_headers(self, part):
+        started = time.perf_counter()
+        data = ''.join(self._policy.fold(name, value) for name, value in part.raw_items())
+        data = data.encode('utf-8', errors='replace') + self._nl
+        METRICS.add('mime_serialize', time.perf_counter() - started, len(data))
+        self._write(data)
+
+    @staticmethod
+    def _make_boundary(part) -> str:
+        """Return a boundary that does not occur in the payloads below ``part``."""
+        payloads = [sub._payload for sub in part.walk() if isinstance(sub._payload, str)]
+        while True:
+            boundary = f"{'=' * 15}{random.randrange(sys.maxsize):019d}=="
+            if not any(boundary in payload for payload in payloads):
+                return boundary
+
+    def _write_part(self, part):
+        payload = part._payload
+        if isinstance(part, StreamedAttachment):
+            self._write_headers(part)
+            for chunk in part.iter_encoded(self._nl):
+                self._write(chunk)
+        elif part.get_content_maintype() == 'multipart' and isinstance(payload, list):
+            boundary = part.get_boundary()
+            if boundary is None:
+                boundary = self._make_boundary(part)
+                part.set_boundary(boundary)
+            self._write_headers(part)
+            delimiter = b'--' + boundary.encode('utf-8', errors='replace')
+            if part.preamble is not None:
+                self._write(self._encode_text(part.preamble) + self._nl)
+            self._write(delimiter + self._nl)
+            for i, subpart in enumerate(payload):
+                if i:
+                    self._write(self._nl + delimiter + self._nl)
+                self._write_part(subpart)
+            self._write(self._nl + delimiter + b'--' + self._nl)
+            if part.epilogue is not None:
+                self._write(self._nl + self._encode_text(part.epilogue))
+        elif payload is None or isinstance(payload, str):
+            self._write_headers(part)
+            if payload:
+                self._write(self._encode_text(payload))
+        else:
+            # Anything else (e.g. message/rfc822 parts) goes through the
+            # standard generator
+            started = time.perf_counter()
+            buffer = io.BytesIO()
+            email.generator.BytesGenerator(buffer, mangle_from_=False, policy=self._policy).flatten(part)
+            data = buffer.getvalue()
+            if self.escape_from and b'From ' in data:
+                data = _MBOX_FROM_RE.sub(rb'>\1', data)
+            METRICS.add('mime_serialize', time.perf_counter() - started, len(data))
+            self._write(data)
+
+def write_message(msg, fp, linesep: Optional[str] = None, escape_from: bool = False) -> int:
+    """Write a message to a binary file, streaming large attachments.
+
+    All line endings are written as ``linesep`` (default ``\\n``). With
+    ``escape_from`` lines starting with ``From `` are escaped for MBOX files.
+    Returns the number of bytes written.
+    """
+    return MessageWriter(fp, linesep or '\n', escape_from).write(msg)
+
+def format_from_line(msg, linesep: str = '\n') -> str:
+    """Build the mbox ``From `` separator line for a message.
+
+    The envelope sender must be a single token, so display names fall back to
+    ``MAILER-DAEMON``. The date is taken from the message's Date header in UTC
+    asctime format.
+    """
+    sender = parseaddr(str(msg.get('From', '')))[1]
+    if not sender or any(c.isspace() for c in sender):
+        sender = 'MAILER-DAEMON'
+
+    date = None
     try:
-        # Get folder name if available
-        if hasattr(folder, 'get_name'):
-            folder_name = folder.get_name() or folder_name
-        elif hasattr(folder, 'name'):
-            folder_name = getattr(folder, 'name', folder_name)
-        
-        # Create safe folder name
-        safe_folder_name = str(folder_name).replace('/', '_').replace('\\', '_')
-        logging.info(f"Processing folder: {folder_name}")
-        
-        # Process subfolders
+        if msg.get('Date'):
+            date = parsedate_to_datetime(str(msg['Date']))
+    except (TypeError, ValueError, IndexError):
+        date = None
+    if date is None:
+        date = datetime.now(timezone.utc)
+    elif date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+
+    return f"From {sender} {date.strftime('%a %b')} {date.day:2d} {date.strftime('%H:%M:%S %Y')}{linesep}"
+
+class MboxWriter:
+    """Append messages to a single MBOX file through one buffered handle.
+
+    The file is opened on the first write and stays open until ``close``.
+    ``flush_every`` flushes the buffer after that many messages (0 only flushes
+    on close). ``fsync`` is one of ``'never'``, ``'close'`` or ``'flush'`` and
+    controls when the data is also forced to disk.
+
+    With ``compression`` (``'gzip'`` or ``'zstd'``) the file is written as one
+    compressed stream, compressed in a background thread. Every writer appends
+    a new gzip member or zstd frame, so compressed files can be concatenated.
+    Offsets are then positions in the uncompressed data of this writer.
+
+    Every line, including the ``From `` separator lines, ends with ``linesep``.
+    """
+
+    FSYNC_POLICIES = ('never', 'close', 'flush')
+
+    def __init__(self, path: str, buffer_size: int = DEFAULT_MBOX_BUFFER_SIZE,
+                 flush_every: int = 0, fsync: str = 'never',
+                 compression: str = 'none', compression_level: Optional[int] = None,
+                 linesep: str = '\r\n'):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        if compression != 'none' and compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression method: {compression}")
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_every = flush_every
+        self.fsync = fsync
+        self.compression = compression
+        self.compression_level = compression_level
+        self.linesep = linesep
+        self.count = 0
+        self._raw = None
+        self._file = None
+        self._unflushed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _open(self):
+        # Ensure the output directory exists
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if self.compression == 'none':
+            self._raw = self._file = open(self.path, 'ab', buffering=self.buffer_size)
+        else:
+            self._raw = open(self.path, 'ab')
+            self._file = CompressedStream(self._raw, self.compression, self.compression_level,
+                                          self.buffer_size)
+
+    def write(self, msg) -> Optional[tuple]:
+        """Append one message and return its ``(offset, length)`` in the file.
+
+        Errors are logged and the message is skipped, returning None.
+        """
         try:
-            if hasattr(folder, 'sub_folders'):
-                for subfolder in folder.sub_folders:
-                    process_folder(subfolder, output_dir, format)
-            elif hasattr(folder, 'get_sub_folders'):
-                for subfolder in folder.get_sub_folders():
-                    process_folder(subfolder, output_dir, format)
+            # Ensure proper MIME structure
+            if not msg.is_multipart():
+                # Convert to multipart if not already
+                new_msg = MIMEMultipart()
+                for key, value in msg.items():
+                    new_msg[key] = value
+                new_msg.attach(MIMEText(msg.get_payload(), 'plain' if msg.get_content_type() == 'text/plain' else 'html'))
+                msg = new_msg
+            
+            # Ensure proper headers for MBOX format
+            if 'From' not in msg:
+                msg['From'] = 'unknown@example.com'
+            if 'Date' not in msg:
+                msg['Date'] = datetime.now().strftime('%a, %d %b %Y %H:%M:%S %z')
+            if 'Message-ID' not in msg:
+                msg['Message-ID'] = f"<{datetime.now().timestamp()}@{os.uname().nodename}>"
+            
+            # Add From_ line required by mbox format
+            from_line = format_from_line(msg, self.linesep).encode('utf-8', errors='replace')
         except Exception as e:
-            logging.warning(f"Could not process subfolders in {folder_name}: {e}")
+            logger.error(f"Error exporting message to MBOX: {e}")
+            return None
 
-        # Process messages
-        if format == 'mbox':
-            mbox_path = os.path.join(output_dir, f"{safe_folder_name}.mbox")
+        if self._file is None:
+            self._open()
+        offset = self._file.tell()
+        try:
+            self._file.write(from_line)
+            # Write the message with proper line endings, escaping body lines
+            # that would otherwise start a new message
+            write_message(msg, self._file, linesep=self.linesep, escape_from=True)
+            separator = (self.linesep * 2).encode('ascii')
+            self._file.write(separator)  # Add separator between messages with proper line endings
+            if self._file is self._raw:
+                METRICS.add('disk_write', 0.0, len(from_line) + len(separator))
+        except Exception as e:
+            logger.error(f"Error exporting message to MBOX: {e}")
+            # Drop the partially written message
             try:
-                messages = []
-                # Different ways to get messages based on pypff version
-                if hasattr(folder, 'sub_messages'):
-                    messages = folder.sub_messages
-                elif hasattr(folder, 'get_number_of_sub_messages'):
-                    messages = [folder.get_sub_message(i) for i in range(folder.get_number_of_sub_messages())]
-                else:
-                    messages = []
-                
-                for message in messages:
-                    try:
-                        if not message:
-                            continue
-                            
-                        msg = create_message(message, folder_name, format)
-                        export_to_mbox([msg], mbox_path)
-                    except Exception as e:
-                        logging.error(f"Error processing message in folder '{folder_name}': {e}")
-                        continue
-            except Exception as e:
-                logging.error(f"Error writing to mbox file {mbox_path}: {e}")
-        
-        elif format == 'eml':
-            folder_path = os.path.join(output_dir, safe_folder_name)
-            os.makedirs(folder_path, exist_ok=True)
-            
+                if self._file is self._raw:
+                    self._file.flush()
+                self._file.truncate(offset)
+                # truncate() leaves the position at the end of the dropped
+                # data, which tell() would report for the next message
+                self._file.seek(offset)
+            except io.UnsupportedOperation:
+                logger.warning(f"Part of the message was already compressed and stays in {self.path}")
+            return None
+        self.count += 1
+
+        self._unflushed += 1
+        if self.flush_every and self._unflushed >= self.flush_every:
+            self.flush()
+        return offset, self._file.tell() - offset
+
+    def flush(self):
+        """Flush buffered data, and fsync it if the policy asks for it."""
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.fsync == 'flush':
+            os.fsync(self._raw.fileno())
+        self._unflushed = 0
+
+    def close(self):
+        """Flush and close the file."""
+        if self._file is None:
+            return
+        try:
+            if self._file is not self._raw:
+                # Write the end of the compressed stream
+                self._file.close()
+            self._raw.flush()
+            if self.fsync != 'never':
+                os.fsync(self._raw.fileno())
+        finally:
+            self._raw.close()
+            self._file = self._raw = None
+
+def open_mbox_writer(output_file: str, options: Optional[ExportOptions] = None) -> MboxWriter:
+    """Create an MboxWriter configured from the export options."""
+    options = options or ExportOptions()
+    return MboxWriter(output_file, buffer_size=options.mbox_buffer_size,
+                      flush_every=options.flush_every, fsync=options.fsync,
+                      compression=options.compression, compression_level=options.compression_level,
+                      linesep=options.linesep('mbox'))
+
+def mbox_filename(folder_name: str, options: Optional[ExportOptions] = None) -> str:
+    """Return the MBOX file name of a folder, with the suffix of its compression."""
+    options = options or ExportOptions()
+    return f"{folder_name}.mbox{COMPRESSION_SUFFIXES.get(options.compression, '')}"
+
+def eml_filename(message) -> str:
+    """Return the EML file name of a message, made from its subject."""
+    subject = getattr(message, 'subject', f"message_{getattr(message, 'entry_id', 'unknown')}")
+    safe_subject = "".join(c for c in str(subject) if c.isalnum() or c in (' ', '.', '_')).replace(' ', '_')
+    return f"{safe_subject}.eml"
+
+def eml_relative_path(message, layout: str = 'flat') -> str:
+    """Return the path of the EML file of a message in its folder directory.
+
+    The ``flat`` layout uses the subject as file name, so messages with the
+    same subject replace each other. The ``hash`` and ``date`` layouts start
+    the name with the message identifier, which is unique in the OST file,
+    and put the file in a subdirectory: the first two hex digits of a hash
+    of the identifier, or the year and month of the delivery time.
+    """
+    if layout == 'flat':
+        return eml_filename(message)
+    identifier = getattr(message, 'identifier', None)
+    if identifier is None and hasattr(message, 'get_identifier'):
+        identifier = message.get_identifier()
+    if identifier is None:
+        identifier = uuid.uuid4().hex
+    subject = eml_filename(message)[:-len('.eml')][:EML_SUBJECT_LENGTH]
+    filename = f"{identifier}_{subject}.eml" if subject else f"{identifier}.eml"
+    if layout == 'hash':
+        shard = hashlib.md5(str(identifier).encode('utf-8')).hexdigest()[:2]
+    elif layout == 'date':
+        delivery_time = getattr(message, 'delivery_time', None)
+        shard = f"{delivery_time.year:04d}/{delivery_time.month:02d}" if delivery_time else 'undated'
+    else:
+        raise ValueError(f"Unknown EML layout: {layout}")
+    return f"{shard}/{filename}"
+
+def temporary_path(path: str) -> str:
+    """Return a unique hidden name next to ``path``, to write a file before renaming it there."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}.{uuid.uuid4().hex[:12]}.tmp")
+
+class BackgroundWriter:
+    """Write-only binary stream whose data is handled by a background thread.
+
+    Written data is gathered into chunks of ``chunk_size`` bytes that are passed
+    to ``sink`` in a worker thread, so compression and disk writes overlap with
+    building the next message. ``call`` runs a function in the worker thread,
+    in order with the data. An error raised in the worker thread is raised again
+    by the next ``write``, ``call``, ``flush`` or ``close``.
+    """
+
+    def __init__(self, sink, chunk_size: int = DEFAULT_MBOX_BUFFER_SIZE,
+                 depth: int = BACKGROUND_QUEUE_DEPTH):
+        self._sink = sink
+        self.chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._position = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=depth)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
             try:
-                # Different ways to get messages based on pypff version
-                if hasattr(folder, 'sub_messages'):
-                    messages = folder.sub_messages
-                elif hasattr(folder, 'get_number_of_sub_messages'):
-                    messages = [folder.get_sub_message(i) for i in range(folder.get_number_of_sub_messages())]
-                else:
-                    messages = []
-                
-                for message in messages:
-                    try:
-                        if not message:
-                            continue
-                            
-                        msg = create_message(message, folder_name, format)
-                        
-                        # Create safe filename
-                        subject = getattr(message, 'subject', f"message_{getattr(message, 'entry_id', 'unknown')}")
-                        safe_subject = "".join(c for c in str(subject) if c.isalnum() or c in (' ', '.', '_')).replace(' ', '_')
-                        
-                        eml_path = os.path.join(folder_path, f"{safe_subject}.eml")
-                        with open(eml_path, "w", encoding='utf-8') as eml_file:
-                            eml_file.write(msg.as_string())
-                            
-                    except Exception as e:
-                        logging.error(f"Error processing message in folder '{folder_name}': {e}")
-                        continue
+                if item is None:
+                    return
+                if self._error is None:
+                    if callable(item):
+                        item()
+                    else:
+                        self._sink(item)
             except Exception as e:
-                logging.error(f"Error processing messages in folder '{folder_name}': {e}")
+                self._error = e
+            finally:
+                self._queue.task_done()
 
-    except Exception as e:
-        logging.error(f"Error processing folder '{folder_name}': {e}")
-        logging.debug(traceback.format_exc())
-        raise
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
 
-def export_ost(ost_path: str, output_dir: str, format: str = 'mbox'):
-    """Export OST file to either MBOX or EML format."""
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    try:
-        # Open OST file
-        ost_file = pypff.file()
+    def _push(self):
+        if self._buffer:
+            self._queue.put(bytes(self._buffer))
+            del self._buffer[:]
+
+    def write(self, data) -> int:
+        self._check()
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= self.chunk_size:
+            self._push()
+        return len(data)
+
+    def tell(self) -> int:
+        """Return the number of bytes written so far."""
+        return self._position
+
+    def truncate(self, position: int):
+        """Drop the data written after ``position`` if it was not handed over yet."""
+        pending = self._position - position
+        if pending < 0 or pending > len(self._buffer):
+            raise io.UnsupportedOperation("data was already handed to the background thread")
+        del self._buffer[len(self._buffer) - pending:]
+        self._position = position
+
+    def call(self, func, wait: bool = False):
+        """Run ``func`` in the worker thread after the data written so far."""
+        self._check()
+        self._push()
+        self._queue.put(func)
+        if wait:
+            self._queue.join()
+            self._check()
+
+    def flush(self):
+        """Wait until the worker thread has handled all the data written so far."""
+        self._push()
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        """Hand over the remaining data and stop the worker thread."""
+        if self._thread is None:
+            return
+        self._push()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._check()
+
+class CompressedStream(BackgroundWriter):
+    """Compress written data into a binary file in a background thread.
+
+    ``method`` is ``'gzip'`` or ``'zstd'``. ``flush`` makes all the data written
+    so far decodable from the file; ``close`` ends the gzip member or zstd frame
+    but leaves the file open.
+    """
+
+    def __init__(self, fileobj, method: str, level: Optional[int] = None,
+                 chunk_size: int = DEFAULT_MBOX_BUFFER_SIZE):
+        if level is None:
+            level = DEFAULT_COMPRESSION_LEVELS[method]
+        if method == 'gzip':
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._sync_mode = zlib.Z_SYNC_FLUSH
+        elif method == 'zstd':
+            if zstandard is None:
+                raise ValueError("zstd compression needs the zstandard package")
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+            self._sync_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            raise ValueError(f"Unknown compression method: {method}")
+        self.fileobj = fileobj
+        super().__init__(self._compress, chunk_size)
+
+    def _write_file(self, data: bytes, flush: bool = False):
+        started = time.perf_counter()
+        self.fileobj.write(data)
+        if flush:
+            self.fileobj.flush()
+        METRICS.add('disk_write', time.perf_counter() - started, len(data))
+
+    def _compress(self, chunk: bytes):
+        started = time.perf_counter()
+        data = self._compressor.compress(chunk)
+        METRICS.add('compress', time.perf_counter() - started, len(chunk))
+        self._write_file(data)
+
+    def _sync(self):
+        self._write_file(self._compressor.flush(self._sync_mode), flush=True)
+
+    def _finish(self):
+        self._write_file(self._compressor.flush(), flush=True)
+
+    def flush(self):
+        self.call(self._sync, wait=True)
+
+    def close(self):
+        if self._thread is None:
+            return
+        self.call(self._finish)
+        super().close()
+
+class MeteredFile:
+    """Seekable binary file whose writes are counted as ``disk_write``.
+
+    Only the bytes that grow the file are counted, so data written again in
+    place (like the zip entry headers) is not counted twice. ``seconds`` adds
+    up the time spent in ``write``, so callers can tell it apart from the work
+    around it. Everything else goes to ``fileobj``.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.seconds = 0.0
+        self._end = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(0)
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+    def write(self, data) -> int:
+        started = time.perf_counter()
+        n = self.fileobj.write(data)
+        end = self.fileobj.tell()
+        elapsed = time.perf_counter() - started
+        self.seconds += elapsed
+        METRICS.add('disk_write', elapsed, max(0, end - self._end))
+        self._end = max(self._end, end)
+        return n
+
+class ZipEmlWriter:
+    """Write EML messages as the entries of a zip archive.
+
+    Each message is first written to a temporary file, kept in memory up to
+    ``spool_size`` bytes, and only added to the archive once it is complete,
+    so a message that fails half way leaves no entry behind. Entries are
+    compressed in a background thread while the next message is built. New
+    entries are added to an existing archive; names already in it get a
+    numbered suffix, since zip entries cannot be replaced.
+    """
+
+    def __init__(self, path: str, level: Optional[int] = None,
+                 chunk_size: int = DEFAULT_MBOX_BUFFER_SIZE, linesep: str = '\n',
+                 spool_size: int = DEFAULT_ATTACHMENT_BUFFER_SIZE):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # compresslevel needs Python 3.7
+        kwargs = {'compresslevel': level} if level is not None else {}
+        self.path = path
+        self.linesep = linesep
+        self.chunk_size = chunk_size
+        self.spool_size = spool_size
+        self._file = MeteredFile(open(path, 'r+b' if os.path.exists(path) else 'w+b'))
         try:
-            ost_file.open(ost_path)
-            
-            # Get root folders
-            root_folders = []
-            try:
-                root_folders = ost_file.get_root_folder().sub_folders
-            except AttributeError:
-                # Try alternative method for getting root folders
-                root_folders = ost_file.get_root_folders()
-            
-            if not root_folders:
-                logging.error("No root folders found in the OST file")
-                return
-                
-            # Process each root folder
-            for root_folder in root_folders:
-                process_folder(root_folder, output_dir, format)
-                
-        except Exception as e:
-            logging.error(f"Error processing OST file: {e}")
-            logging.debug(traceback.format_exc())
+            self._zip = zipfile.ZipFile(self._file, 'a', zipfile.ZIP_DEFLATED, **kwargs)
+        except BaseException:
+            self._file.close()
             raise
-            
+        self._names = set(self._zip.namelist())
+        self._stream = BackgroundWriter(None, chunk_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _unique_name(self, name: str) -> str:
+        base, extension = os.path.splitext(name)
+        n = 2
+        while name in self._names:
+            name = f"{base}_{n}{extension}"
+            n += 1
+        self._names.add(name)
+        return name
+
+    def _add_entry(self, name: str, spool):
+        try:
+            with self._zip.open(name, 'w') as entry:
+                while True:
+                    chunk = spool.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    started = time.perf_counter()
+                    written = self._file.seconds
+                    entry.write(chunk)
+                    elapsed = time.perf_counter() - started - (self._file.seconds - written)
+                    METRICS.add('compress', elapsed, len(chunk))
         finally:
-            if hasattr(ost_file, 'close'):
-                ost_file.close()
-        logging.info(f"Conversion completed successfully! Files saved in: {output_dir}")
-        
-    except Exception as e:
-        if hasattr(e, '__module__') and e.__module__.startswith('pypff'):
-            logging.error(f"Error processing OST file (pypff error): {e}")
-        else:
-            logging.error(f"Unexpected error: {e}")
-        logging.debug(traceback.format_exc())
-        sys.exit(1)
+            spool.close()
 
-if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python ost_export.py <ost_file> <output_directory> <format>")
-        print("Format can be either 'mbox' or 'eml'")
-        sys.exit(1)
+    def _write_entry(self, name: str, write) -> str:
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        try:
+            write(spool)
+            spool.seek(0)
+        except Exception:
+            spool.close()
+            raise
+        name = self._unique_name(name)
+        self._stream.call(functools.partial(self._add_entry, name, spool))
+        return name
 
-    ost_path = sys.argv[1]
-    output_dir = sys.argv[2]
-    format = sys.argv[3].lower()
-    
-    if format not in ['mbox', 'eml']:
-        print("Format must be either 'mbox' or 'eml'")
+    def write(self, name: str, msg) -> str:
+        """Add a message as entry ``name`` and return the name actually used."""
+        return self._write_entry(name, lambda fp: write_message(msg, fp, self.linesep))
+
+    def copy(self, name: str, fileobj) -> str:
+        """Add the content of a binary file as entry ``name``."""
+        return self._write_entry(name, lambda fp: shutil.copyfileobj(fileobj, fp, self.chunk_size))
+
+    def close(self):
+        if self._zip is None:
+            return
+        try:
+            self._stream.close()
+        finally:
+            try:
+                self._zip.close()
+            finally:
+                self._file.close()
+                self._zip = None
+
+def imap_utf7_encode(name: str) -> str:
+    """Encode a mailbox name in the modified UTF-7 of IMAP (RFC 3501 section 5.1.3).
+
+    Printable ASCII is kept, '&' becomes '&-' and every other run of characters
+    becomes '&' + base64 of its UTF-16BE form, with ',' for '/' and no padding, + '-'.
+    """
+    result = []
+    pending = []
+
+    def flush():
+        if pending:
+            data = ''.join(pending).encode('utf-16-be')
+            encoded = base64.b64encode(data).decode('ascii').rstrip('=').replace('/', ',')
+            result.append('&' + encoded + '-')
+            del pending[:]
+
+    for char in name:
+        if 0x20 <= ord(char) <= 0x7e:
+            flush()
+            result.append('&-' if char == '&' else char)
+        else:
+            pending.append(char)
+    flush()
+    return ''.join(result)
+
+def maildir_folder_name(folder_path: str) -> str:
+    """Return the Maildir++ directory of a folder path, '.Inbox.Projects' for 'Inbox/Projects'.
+
+    Names are encoded in modified UTF-7 like Dovecot and Courier expect, so
+    'Entwürfe' becomes '.Entw&APw-rfe'.
+    """
+    parts = [imap_utf7_encode(part.replace('.', '_').replace('\\', '_')) or '_'
+             for part in folder_path.split('/')]
+    return '.' + '.'.join(parts)
+
+def create_maildir(path: str, subfolder: bool = True):
+    """Create the tmp, new and cur directories of a Maildir.
+
+    Subfolders also get the ``maildirfolder`` file of the Maildir++ layout.
+    """
+    for name in MAILDIR_SUBDIRS:
+        os.makedirs(os.path.join(path, name), exist_ok=True)
+    if subfolder:
+        open(os.path.join(path, 'maildirfolder'), 'a').close()
+
+class MaildirWriter:
+    """Deliver messages to a Maildir folder without any locking.
+
+    Every message is written to ``tmp/`` under a name unique to the delivery
+    and renamed into ``new/`` once it is complete, so readers never see a
+    partial file and several processes can deliver to the same folder at once,
+    even the same message. File names are made of the delivery
+    time, a digest of a string unique to the message and the host name, so
+    exporting a message again replaces its file instead of adding a copy. The
+    modification time of a file is the delivery time of its message.
+
+    With an ``fsync`` policy other than ``'never'`` every file is forced to
+    disk before it is renamed.
+    """
+
+    def __init__(self, path: str, linesep: str = '\n', fsync: str = 'never'):
+        self.path = path
+        self.linesep = linesep
+        self.fsync = fsync
+        create_maildir(path)
+
+    @staticmethod
+    def timestamp(delivery_time: Optional[datetime] = None) -> int:
+        """Return the Unix time of a delivery time, naive ones being UTC."""
+        if delivery_time is None:
+            return int(time.time())
+        return calendar.timegm(delivery_time.utctimetuple())
+
+    @classmethod
+    def filename(cls, unique: str, delivery_time: Optional[datetime] = None) -> str:
+        """Return the file name of the message identified by ``unique``."""
+        digest = hashlib.md5(unique.encode('utf-8', errors='replace')).hexdigest()[:16]
+        return f"{cls.timestamp(delivery_time)}.X{digest}.{MAILDIR_HOSTNAME}"
+
+    def write(self, msg, name: str, delivery_time: Optional[datetime] = None) -> str:
+        """Deliver a message as ``name``; return its path relative to the folder."""
+        tmp_path = temporary_path(os.path.join(self.path, 'tmp', name))
+        try:
+            with open(tmp_path, 'xb') as f:
+                write_message(msg, f, self.linesep)
+                if self.fsync != 'never':
+                    f.flush()
+                    os.fsync(f.fileno())
+            if delivery_time is not None:
+                seconds = self.timestamp(delivery_time)
+                os.utime(tmp_path, (seconds, seconds))
+            os.replace(tmp_path, os.path.join(self.path, 'new', name))
+        except Exception:
+            # Do not leave a partial file behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return os.path.join('new', name)
+
+def export_to_mbox(messages, output_file, options: Optional[ExportOptions] = None):
+    """Export messages to an MBOX file with proper formatting."""
+    with open_mbox_writer(output_file, options) as writer:
+        for msg in messages:
+            writer.write(msg)
+
+def get_message_key(message) -> tuple:
+    """Return the ``(identifier, delivery_time)`` pair identifying a message in its folder."""
+    identifier = getattr(message, 'identifier', None)
+    if identifier is None and hasattr(message, 'get_identifier'):
+        identifier = message.get_identifier()
+    delivery_time = getattr(message, 'delivery_time', None)
+    return (str(identifier), delivery_time.isoformat() if delivery_time else '')
+
+class CheckpointStore:
+    """SQLite index of the messages already exported to an output directory.
+
+    Every exported message is recorded by folder path, message identifier and
+    delivery time, together with its output file (relative to the output
+    directory) and, for MBOX files, the byte offset and length of the message.
+    The size of an MBOX file is recorded by ``start_file`` before messages are
+    appended to it.
+    Records are kept in memory and written on ``commit``, in one short
+    transaction so parallel workers sharing the database do not wait on each
+    other, which callers must do after the matching output has been flushed.
+    ``recover`` drops everything written after the last commit, so an
+    interrupted export can be resumed.
+
+    Records written by parallel workers carry the id of their work unit and
+    offsets relative to the staged part until ``release_unit`` is called for
+    the merged unit.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, CHECKPOINT_FILENAME)
+        self._records = []
+        self._duplicates = None
+        self._conn = sqlite3.connect(self.path, timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS exported (
+                folder_path TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                delivery_time TEXT NOT NULL,
+                output_path TEXT NOT NULL,
+                offset INTEGER,
+                length INTEGER,
+                unit TEXT,
+                PRIMARY KEY (folder_path, message_id, delivery_time)
+            )""")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                output_path TEXT PRIMARY KEY,
+                committed_end INTEGER NOT NULL
+            )""")
+        self._conn.execute(DUPLICATES_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+    @property
+    def pending(self) -> int:
+        return len(self._records)
+
+    def duplicate_index(self) -> 'DuplicateIndex':
+        """Return a duplicate index kept in this database and written by ``commit``."""
+        self._duplicates = DuplicateIndex(self.output_dir, self._conn)
+        return self._duplicates
+
+    def done_keys(self, folder_path: str) -> set:
+        """Return the keys of the messages of a folder that are already exported."""
+        rows = self._conn.execute(
+            'SELECT message_id, delivery_time FROM exported WHERE folder_path = ? AND unit IS NULL',
+            (folder_path,))
+        return set(rows)
+
+    def record(self, folder_path: str, key: tuple, output_path: str,
+               offset: Optional[int] = None, length: Optional[int] = None,
+               unit: Optional[str] = None):
+        """Record an exported message; it is only written by ``commit``."""
+        self._records.append((folder_path, key[0], key[1], output_path, offset, length, unit))
+
+    def start_file(self, output_path: str, size: int):
+        """Record at once the size of an MBOX file that messages are about to be appended to."""
+        with self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?)', (output_path, size))
+
+    def commit(self):
+        """Write the records and fingerprints made since the last commit."""
+        fingerprints = self._duplicates.pending_rows() if self._duplicates is not None else []
+        with self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO exported VALUES (?, ?, ?, ?, ?, ?, ?)', self._records)
+            self._conn.executemany('INSERT OR IGNORE INTO fingerprints VALUES (?, ?, ?, ?, ?)', fingerprints)
+        self._records = []
+        if fingerprints:
+            self._duplicates.clear_pending()
+
+    def release_unit(self, unit: str, base_offset: int = 0):
+        """Mark the records of a merged work unit as final."""
+        self._conn.execute(
+            'UPDATE exported SET offset = offset + ?, unit = NULL WHERE unit = ?',
+            (base_offset, unit))
+        self._conn.execute('UPDATE fingerprints SET unit = NULL WHERE unit = ?', (unit,))
+        self.commit()
+
+    def recover(self):
+        """Undo the effects of an interrupted export."""
+        # Records of work units that were never merged
+        self._conn.execute('DELETE FROM exported WHERE unit IS NOT NULL')
+        self._conn.execute('DELETE FROM fingerprints WHERE unit IS NOT NULL')
+        self.commit()
+
+        # Staging directories of interrupted parallel exports
+        for entry in os.listdir(self.output_dir):
+            if entry.startswith('.ost_export-') and os.path.isdir(os.path.join(self.output_dir, entry)):
+                shutil.rmtree(os.path.join(self.output_dir, entry), ignore_errors=True)
+
+        # Maildir messages that were never moved to new/
+        for entry in os.listdir(self.output_dir):
+            tmp_dir = os.path.join(self.output_dir, entry, 'tmp')
+            if entry.startswith('.') and os.path.isfile(os.path.join(self.output_dir, entry, 'maildirfolder')) \
+                    and os.path.isdir(tmp_dir):
+                for filename in os.listdir(tmp_dir):
+                    os.remove(os.path.join(tmp_dir, filename))
+
+        # Messages appended to MBOX files after the last commit, including
+        # files whose first messages were never committed
+        rows = self._conn.execute(
+            'SELECT output_path, MAX(end) FROM ('
+            'SELECT output_path, offset + length AS end FROM exported WHERE offset IS NOT NULL '
+            'UNION ALL SELECT output_path, committed_end FROM files) GROUP BY output_path').fetchall()
+        for output_path, end in rows:
+            path = os.path.join(self.output_dir, output_path)
+            if os.path.exists(path) and os.path.getsize(path) > end:
+                logger.warning(f"Discarding {os.path.getsize(path) - end} bytes of an interrupted export "
+                               f"at the end of {path}")
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+
+def message_fingerprint(message) -> bytes:
+    """Return a 16 byte digest identifying a message whatever its folder.
+
+    It covers the subject, sender, recipients, delivery time, the body that
+    would be exported and the attachment sizes, so copies of a message in
+    several folders get the same fingerprint. Attachment data is not read.
+    """
+    sha256 = hashlib.sha256()
+    for name in ('subject', 'sender_name', 'display_to', 'display_cc'):
+        sha256.update(str(getattr(message, name, '') or '').encode('utf-8', errors='replace'))
+        sha256.update(b'\0')
+    delivery_time = getattr(message, 'delivery_time', None)
+    sha256.update((delivery_time.isoformat() if delivery_time else '').encode('ascii'))
+    body = getattr(message, 'html_body', None) or getattr(message, 'plain_text_body', None) or b''
+    sha256.update(b'\0')
+    sha256.update(body if isinstance(body, bytes) else str(body).encode('utf-8', errors='replace'))
+    for attachment in get_message_attachments(message):
+        sha256.update(b'\0%d' % (getattr(attachment, 'size', 0) or 0))
+    return sha256.digest()[:16]
+
+class DuplicateIndex:
+    """Fingerprints of the exported messages, to find copies in other folders.
+
+    Every exported message is recorded with its folder path, its output file
+    relative to ``output_dir`` and, for EML files, the inode of the file so a
+    copy can be hard linked to it. Without ``connection`` the index is a dict
+    in memory. Otherwise it is the ``fingerprints`` table of that SQLite
+    database: the checkpoint database, where the records wait in memory for
+    the next commit of the checkpoint store, or with ``autocommit`` a database
+    shared by the parallel workers.
+    """
+
+    def __init__(self, output_dir: str, connection: Optional[sqlite3.Connection] = None,
+                 autocommit: bool = False):
+        self.output_dir = output_dir
+        self.autocommit = autocommit
+        self._conn = connection
+        self._memory = {} if connection is None else None
+        self._pending = {}
+        if connection is not None:
+            connection.execute(DUPLICATES_SCHEMA)
+            connection.commit()
+
+    @classmethod
+    def open(cls, output_dir: str, path: str) -> 'DuplicateIndex':
+        """Open the database of the index shared by the parallel workers."""
+        connection = sqlite3.connect(path, timeout=60)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        return cls(output_dir, connection, autocommit=True)
+
+    def get(self, fingerprint: bytes) -> Optional[tuple]:
+        """Return ``(folder_path, output_path, inode)`` of an exported copy, or None."""
+        if self._memory is not None:
+            return self._memory.get(fingerprint)
+        if fingerprint in self._pending:
+            return self._pending[fingerprint][1:4]
+        row = self._conn.execute('SELECT folder_path, output_path, inode FROM fingerprints WHERE fingerprint = ?',
+                                 (fingerprint,)).fetchone()
+        return tuple(row) if row else None
+
+    def add(self, fingerprint: bytes, folder_path: str, output_path: str,
+            inode: Optional[int] = None, unit: Optional[str] = None):
+        """Record an exported message, keeping the first copy."""
+        if self._memory is not None:
+            self._memory.setdefault(fingerprint, (folder_path, output_path, inode))
+            return
+        row = (fingerprint, folder_path, output_path, inode, unit)
+        if not self.autocommit:
+            self._pending.setdefault(fingerprint, row)
+            return
+        with self._conn:
+            self._conn.execute('INSERT OR IGNORE INTO fingerprints VALUES (?, ?, ?, ?, ?)', row)
+
+    def pending_rows(self) -> list:
+        """Return the records waiting for the commit of the checkpoint store."""
+        return list(self._pending.values())
+
+    def clear_pending(self):
+        self._pending.clear()
+
+    def link(self, original: tuple, path: str, output_dirs: tuple) -> bool:
+        """Hard link ``path`` to the EML file of an exported copy, if it is still there."""
+        if original[2] is None:
+            return False
+        for output_dir in output_dirs:
+            source = os.path.join(output_dir, original[1])
+            try:
+                if os.stat(source).st_ino != original[2]:
+                    continue
+                if os.path.abspath(source) == os.path.abspath(path):
+                    # Same folder and file name: the file is already there
+                    return True
+                if os.path.lexists(path):
+                    os.remove(path)
+                os.link(source, path)
+                return True
+            except OSError:
+                continue
+        return False
+
+    def close(self):
+        if self.autocommit:
+            self._conn.close()
+
+def create_duplicate_reference(message, original_folder: str):
+    """Build a short message standing for a copy of an exported message."""
+    msg = MIMEMultipart('mixed')
+    if getattr(message, 'subject', None):
+        msg['Subject'] = str(message.subject)
+    if getattr(message, 'sender_name', None):
+        msg['From'] = str(message.sender_name)
+    if getattr(message, 'display_to', None):
+        msg['To'] = str(message.display_to)
+    if getattr(message, 'display_cc', None):
+        msg['Cc'] = str(message.display_cc)
+    if getattr(message, 'delivery_time', None):
+        msg['Date'] = message.delivery_time.strftime('%a, %d %b %Y %H:%M:%S %z')
+    msg['MIME-Version'] = '1.0'
+    msg['X-Duplicate-Of'] = original_folder
+    msg.attach(MIMEText(f"This message is a copy of a message exported from the folder '{original_folder}'.\n",
+                        'plain', 'utf-8'))
+    return msg
+
+def fts5_available() -> bool:
+    """Return whether the SQLite library has the FTS5 full-text search extension."""
+    try:
+        connection = sqlite3.connect(':memory:')
+        try:
+            connection.execute('CREATE VIRTUAL TABLE probe USING fts5(text)')
+        finally:
+            connection.close()
+        return True
+    except sqlite3.Error:
+        return False
+
+class SearchIndex:
+    """SQLite FTS5 index of the exported messages, filled during the export.
+
+    Every message is indexed from what the export has already computed: its
+    headers, the plain text of its body and the names of its attachments. It
+    is stored with its output file, relative to ``output_dir``, and for
+    uncompressed MBOX files the byte offset and length of the message, so a
+    search result can be opened without reading the output again.
+
+    Like ``CheckpointStore``, records are kept in memory and written in one
+    short transaction on ``commit``, which callers do every
+    ``SEARCH_INDEX_BATCH_SIZE`` messages after flushing the output. Records
+    of parallel work units carry the id of their unit and offsets relative to
+    the staged part until ``release_unit``.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, SEARCH_INDEX_FILENAME)
+        self._records = []
+        self._conn = sqlite3.connect(self.path, timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in SEARCH_INDEX_SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+    def add(self, folder_path: str, key: tuple, msg, output_path: str,
+            offset: Optional[int] = None, length: Optional[int] = None,
+            unit: Optional[str] = None):
+        """Index a message made by ``create_message``, replacing an earlier export of it.
+
+        The message is only written to the index by ``commit``.
+        """
+        recipients = ', '.join(str(msg[name]) for name in ('To', 'Cc') if msg[name])
+        self._records.append((
+            (folder_path, key[0], key[1], output_path, offset, length, unit),
+            (str(msg['Subject'] or ''), str(msg['From'] or ''), recipients,
+             getattr(msg, 'plain_text', None) or '', '\n'.join(getattr(msg, 'attachment_names', ())))))
+
+    @property
+    def pending(self) -> int:
+        return len(self._records)
+
+    def commit(self):
+        """Write the messages indexed since the last commit."""
+        with self._conn:
+            for location, fields in self._records:
+                row = self._conn.execute(
+                    'SELECT id FROM locations WHERE folder_path = ? AND message_id = ? AND delivery_time = ?',
+                    location[:3]).fetchone()
+                if row:
+                    self._conn.execute('DELETE FROM messages WHERE rowid = ?', row)
+                    self._conn.execute('DELETE FROM locations WHERE id = ?', row)
+                cursor = self._conn.execute(
+                    'INSERT INTO locations (folder_path, message_id, delivery_time, output_path, offset, length, '
+                    'unit) VALUES (?, ?, ?, ?, ?, ?, ?)', location)
+                self._conn.execute(
+                    'INSERT INTO messages (rowid, subject, sender, recipients, body, attachments) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', (cursor.lastrowid,) + fields)
+        self._records = []
+
+    def release_unit(self, unit: str, base_offset: int = 0):
+        """Mark the records of a merged work unit as final."""
+        self._conn.execute(
+            'UPDATE locations SET offset = offset + ?, unit = NULL WHERE unit = ?',
+            (base_offset, unit))
+        self.commit()
+
+    def recover(self):
+        """Drop the records of work units that were never merged."""
+        self._conn.execute('DELETE FROM messages WHERE rowid IN (SELECT id FROM locations WHERE unit IS NOT NULL)')
+        self._conn.execute('DELETE FROM locations WHERE unit IS NOT NULL')
+        self.commit()
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """Return the best matches of an FTS5 query, as dicts with the location of each message."""
+        rows = self._conn.execute(
+            'SELECT l.output_path, l.offset, l.length, l.folder_path, l.delivery_time, m.subject, m.sender '
+            'FROM messages m JOIN locations l ON l.id = m.rowid '
+            'WHERE messages MATCH ? AND l.unit IS NULL ORDER BY m.rank LIMIT ?', (query, limit))
+        names = ('output_path', 'offset', 'length', 'folder_path', 'delivery_time', 'subject', 'sender')
+        return [dict(zip(names, row)) for row in rows]
+
+def get_folder_name(folder, default: str = "UnknownFolder") -> str:
+    """Return the display name of a folder for both pypff API styles."""
+    folder_name = default
+    if hasattr(folder, 'get_name'):
+        folder_name = folder.get_name() or folder_name
+    elif hasattr(folder, 'name'):
+        folder_name = getattr(folder, 'name', folder_name)
+    return folder_name
+
+def get_sub_folders(folder) -> list:
+    """Return the direct subfolders of a folder for both pypff API styles."""
+    if hasattr(folder, 'sub_folders'):
+        return list(folder.sub_folders)
+    elif hasattr(folder, 'get_sub_folders'):
+        return list(folder.get_sub_folders())
+    return []
+
+def count_messages(folder) -> int:
+    """Return the number of messages in a folder without reading them."""
+    if hasattr(folder, 'get_number_of_sub_messages'):
+        return folder.get_number_of_sub_messages()
+    elif hasattr(folder, 'sub_messages'):
+        return len(folder.sub_messages)
+    return 0
+
+def get_root_folders(ost_file) -> list:
+    """Return the top level folders of an opened OST file."""
+    try:
+        return get_sub_folders(ost_file.get_root_folder())
+    except AttributeError:
+        # Try alternative method for getting root folders
+        return list(ost_file.get_root_folders())
+
+def iter_folder_messages(folder, start: int = 0, stop: Optional[int] = None):
+    """Lazily yield the messages of a folder in the range [start, stop).
+
+    Messages are fetched one at a time, so only the message being exported is
+    alive, whatever the size of the folder.
+    """
+    # Different ways to get messages based on pypff version
+    if hasattr(folder, 'get_number_of_sub_messages') and hasattr(folder, 'get_sub_message'):
+        count = folder.get_number_of_sub_messages()
+        if stop is not None:
+            count = min(count, stop)
+        for i in range(start, count):
+            started = time.perf_counter()
+            message = folder.get_sub_message(i)
+            METRICS.add('pypff_read', time.perf_counter() - started)
+            yield message
+    elif hasattr(folder, 'sub_messages'):
+        messages = itertools.islice(iter(folder.sub_messages), start, stop)
+        end = object()
+        while True:
+            started = time.perf_counter()
+            message = next(messages, end)
+            METRICS.add('pypff_read', time.perf_counter() - started)
+            if message is end:
+                return
+            yield message
+
+class FolderOutput:
+    """Where the messages of one folder are written, for one output format.
+
+    ``write`` stores a message and returns its ``(output_path, offset,
+    length)`` location relative to the output directory, or None if it could
+    not be written. Formats that keep one file per message also ``link`` copies
+    to the file of an exported message and report its ``inode``. Formats that
+    append the messages of a folder to one file give its size before the
+    export as ``start``.
+    """
+
+    start = None
+
+    def __init__(self, output_dir: str, description: str):
+        self.output_dir = output_dir
+        self.description = description
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def write(self, message, key: tuple, msg) -> Optional[tuple]:
+        raise NotImplementedError
+
+    def link(self, message, key: tuple, original: tuple, duplicates: DuplicateIndex) -> Optional[tuple]:
+        """Hard link a copy to the exported message ``original``; None if not possible."""
+        return None
+
+    def inode(self, output_path: str) -> Optional[int]:
+        return None
+
+    def flush(self):
+        """Write buffered data out before checkpoints that point to it are committed."""
+
+    def close(self):
+        pass
+
+class MboxFolderOutput(FolderOutput):
+    def __init__(self, output_dir: str, safe_folder_name: str, options: ExportOptions):
+        self.name = mbox_filename(safe_folder_name, options)
+        path = os.path.join(output_dir, self.name)
+        super().__init__(output_dir, f"mbox file {path}")
+        # Offsets in compressed files cannot be seeked to
+        self._seekable = options.compression == 'none'
+        self.start = os.path.getsize(path) if os.path.exists(path) else 0
+        self._writer = open_mbox_writer(path, options)
+
+    def write(self, message, key: tuple, msg) -> Optional[tuple]:
+        location = self._writer.write(msg)
+        if not location:
+            return None
+        return (self.name,) + (tuple(location) if self._seekable else (None, None))
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+
+class ZipFolderOutput(FolderOutput):
+    def __init__(self, output_dir: str, safe_folder_name: str, options: ExportOptions):
+        self.name = f"{safe_folder_name}.zip"
+        path = os.path.join(output_dir, self.name)
+        super().__init__(output_dir, f"zip file {path}")
+        self._layout = options.eml_layout
+        self._writer = ZipEmlWriter(path, options.compression_level, options.mbox_buffer_size,
+                                    options.linesep('eml'), options.attachment_buffer_size)
+
+    def write(self, message, key: tuple, msg) -> Optional[tuple]:
+        entry_name = self._writer.write(eml_relative_path(message, self._layout), msg)
+        return (f"{self.name}/{entry_name}", None, None)
+
+    def close(self):
+        self._writer.close()
+
+class EmlFolderOutput(FolderOutput):
+    def __init__(self, output_dir: str, safe_folder_name: str, options: ExportOptions):
+        super().__init__(output_dir, f"EML folder {safe_folder_name}")
+        self.name = safe_folder_name
+        self._layout = options.eml_layout
+        self._linesep = options.linesep('eml')
+        eml_dir = os.path.join(output_dir, safe_folder_name)
+        os.makedirs(eml_dir, exist_ok=True)
+        # Subdirectories already created, so files are created without
+        # looking up their directory first
+        self._created_dirs = {eml_dir}
+
+    def _output_path(self, message) -> str:
+        output_path = os.path.join(self.name, *eml_relative_path(message, self._layout).split('/'))
+        parent = os.path.dirname(os.path.join(self.output_dir, output_path))
+        if parent not in self._created_dirs:
+            os.makedirs(parent, exist_ok=True)
+            self._created_dirs.add(parent)
+        return output_path
+
+    def write(self, message, key: tuple, msg) -> Optional[tuple]:
+        output_path = self._output_path(message)
+        eml_path = os.path.join(self.output_dir, output_path)
+        # The file may be a hard link to a copy in another folder, so it is
+        # replaced instead of being written over
+        tmp_path = temporary_path(eml_path)
+        try:
+            with open(tmp_path, "xb") as eml_file:
+                write_message(msg, eml_file, self._linesep)
+            os.replace(tmp_path, eml_path)
+        except Exception:
+            # Do not leave a partial file behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return (output_path, None, None)
+
+    def link(self, message, key: tuple, original: tuple, duplicates: DuplicateIndex) -> Optional[tuple]:
+        output_path = self._output_path(message)
+        if duplicates.link(original, os.path.join(self.output_dir, output_path),
+                           (duplicates.output_dir, self.output_dir)):
+            return (output_path, None, None)
+        return None
+
+    def inode(self, output_path: str) -> Optional[int]:
+        return os.stat(os.path.join(self.output_dir, output_path)).st_ino
+
+class MaildirFolderOutput(FolderOutput):
+    def __init__(self, output_dir: str, folder_path: str, options: ExportOptions):
+        self.name = maildir_folder_name(folder_path)
+        super().__init__(output_dir, f"Maildir folder {self.name}")
+        self.folder_path = folder_path
+        self._writer = MaildirWriter(os.path.join(output_dir, self.name), options.linesep('maildir'),
+                                     options.fsync)
+
+    def _filename(self, message, key: tuple) -> str:
+        return self._writer.filename(f"{self.folder_path}\0{key[0]}\0{key[1]}",
+                                     getattr(message, 'delivery_time', None))
+
+    def write(self, message, key: tuple, msg) -> Optional[tuple]:
+        name = self._writer.write(msg, self._filename(message, key), getattr(message, 'delivery_time', None))
+        return (os.path.join(self.name, name), None, None)
+
+    def link(self, message, key: tuple, original: tuple, duplicates: DuplicateIndex) -> Optional[tuple]:
+        output_path = os.path.join(self.name, 'new', self._filename(message, key))
+        if duplicates.link(original, os.path.join(self.output_dir, output_path),
+                           (duplicates.output_dir, self.output_dir)):
+            return (output_path, None, None)
+        return None
+
+    def inode(self, output_path: str) -> Optional[int]:
+        return os.stat(os.path.join(self.output_dir, output_path)).st_ino
+
+def open_folder_output(output_dir: str, format: str, folder_name, folder_path: str,
+                       options: ExportOptions) -> FolderOutput:
+    """Return the output of a folder for an export ``format``."""
+    safe_folder_name = str(folder_name).replace('/', '_').replace('\\', '_')
+    if format == 'mbox':
+        return MboxFolderOutput(output_dir, safe_folder_name, options)
+    if format == 'eml' and options.compression == 'zip':
+        return ZipFolderOutput(output_dir, safe_folder_name, options)
+    if format == 'eml':
+        return EmlFolderOutput(output_dir, safe_folder_name, options)
+    if format == 'maildir':
+        return MaildirFolderOutput(output_dir, folder_path, options)
+    raise ValueError(f"Unknown export format: {format}")
+
+def export_folder_messages(folder, output_dir: str, format: str = 'mbox',
+                           start: int = 0, stop: Optional[int] = None,
+                           options: Optional[ExportOptions] = None,
+                           folder_path: Optional[str] = None,
+                           checkpoint: Optional[CheckpointStore] = None,
+                           unit: Optional[str] = None,
+                           duplicates: Optional[DuplicateIndex] = None,
+                           search_index: Optional[SearchIndex] = None):
+    """Export the messages of a single folder, without descending into subfolders.
+
+    With a ``checkpoint`` store, messages it already knows are skipped and the
+    exported ones are recorded under ``folder_path`` (and ``unit`` for the
+    parallel export workers). Messages rejected by the message filter of the
+    options are skipped before anything besides their properties is read.
+    With a ``duplicates`` index, messages already exported from another folder
+    are skipped or replaced by a reference, as set by ``dedup_messages``. With
+    a ``search_index``, every exported message is also indexed there.
+    """
+    options = options or ExportOptions()
+    folder_name = get_folder_name(folder)
+    folder_path = folder_path or str(folder_name)
+    done = checkpoint.done_keys(folder_path) if checkpoint else set()
+    skipped = 0
+    filtered = 0
+    message_filter = options.message_filter
+
+    output = None
+    try:
+        with open_folder_output(output_dir, format, folder_name, folder_path, options) as output:
+            if checkpoint and unit is None and output.start is not None:
+                # Data appended from here on is dropped by recover until its
+                # records are committed
+                checkpoint.start_file(output.name, output.start)
+            for message in iter_folder_messages(folder, start, stop):
+                _report_progress()
+                try:
+                    if not message:
+                        continue
+                    
+                    if message_filter and not message_filter.message_selected(message):
+                        filtered += 1
+                        continue
+                    
+                    key = get_message_key(message)
+                    if checkpoint and key in done:
+                        skipped += 1
+                        continue
+                    
+                    original = None
+                    if duplicates is not None:
+                        fingerprint = message_fingerprint(message)
+                        original = duplicates.get(fingerprint)
+                        if original is not None:
+                            METRICS.count('duplicates')
+                            if options.dedup_messages == 'skip':
+                                continue
+                    
+                    # Copies are hard linked to the exported file when possible
+                    location = original is not None and output.link(message, key, original, duplicates)
+                    if not location:
+                        if original is None:
+                            msg = create_message(message, folder_name, format, options)
+                        else:
+                            msg = create_duplicate_reference(message, original[0])
+                        location = output.write(message, key, msg)
+                    if not location:
+                        METRICS.count('errors')
+                        continue
+                    
+                    output_path = location[0]
+                    if original is None:
+                        METRICS.count('messages')
+                        if duplicates is not None:
+                            duplicates.add(fingerprint, folder_path, output_path, output.inode(output_path), unit)
+                        if search_index is not None:
+                            search_index.add(folder_path, key, msg, *location, unit=unit)
+                            if search_index.pending >= SEARCH_INDEX_BATCH_SIZE:
+                                output.flush()
+                                search_index.commit()
+                    
+                    if checkpoint:
+                        checkpoint.record(folder_path, key, *location, unit=unit)
+                        if checkpoint.pending >= CHECKPOINT_BATCH_SIZE:
+                            # Records must never point past the data on disk
+                            output.flush()
+                            checkpoint.commit()
+                except Exception as e:
+                    logger.error(f"Error processing message in folder '{folder_name}': {e}")
+                    METRICS.count('errors')
+                    continue
+    except Exception as e:
+        if output is None:
+            logger.error(f"Error opening the output of folder '{folder_name}': {e}")
+        else:
+            logger.error(f"Error writing to {output.description}: {e}")
+
+    METRICS.count('skipped', skipped)
+    METRICS.count('filtered', filtered)
+    if search_index is not None:
+        search_index.commit()
+    if checkpoint:
+        checkpoint.commit()
+        if skipped:
+            logger.info(f"Skipped {skipped} already exported messages in folder '{folder_path}'")
+
+def walk_folders(root_folders, message_filter: Optional[MessageFilter] = None,
+                 subfolders_first: bool = False, parent_path: str = ''):
+    """Yield ``(folder, folder_path, index_path)`` for every folder below ``root_folders``.
+
+    ``index_path`` locates the folder from the root folders by subfolder index.
+    Parents come before their subfolders, or after them with
+    ``subfolders_first``, the order in which the export writes the folders.
+    Folders excluded by ``message_filter`` are skipped with their subfolders.
+    """
+    def walk(folder, index_path, parent_path):
+        folder_name = get_folder_name(folder)
+        folder_path = f"{parent_path}/{folder_name}" if parent_path else str(folder_name)
+        if message_filter and message_filter.folder_excluded(folder_path):
+            logger.info(f"Skipping excluded folder: {folder_path}")
+            return
+        if not subfolders_first:
+            yield folder, folder_path, index_path
+        try:
+            sub_folders = list(get_sub_folders(folder))
+        except Exception as e:
+            logger.warning(f"Could not read subfolders of {folder_name}: {e}")
+            sub_folders = []
+        for i, subfolder in enumerate(sub_folders):
+            yield from walk(subfolder, index_path + (i,), folder_path)
+        if subfolders_first:
+            yield folder, folder_path, index_path
+
+    for i, root_folder in enumerate(root_folders):
+        yield from walk(root_folder, (i,), parent_path)
+
+def process_folder(folder, output_dir: str, format: str = 'mbox',
+                   options: Optional[ExportOptions] = None,
+                   checkpoint: Optional[CheckpointStore] = None,
+                   parent_path: str = '',
+                   duplicates: Optional[DuplicateIndex] = None,
+                   search_index: Optional[SearchIndex] = None):
+    """Process a folder and its subfolders, indexing the messages in ``search_index`` if given."""
+    message_filter = options.message_filter if options else None
+    for sub_folder, folder_path, _ in walk_folders([folder], message_filter, subfolders_first=True,
+                                                   parent_path=parent_path):
+        if message_filter and not message_filter.folder_selected(folder_path):
+            continue
+        logger.info(f"Processing folder: {folder_path}")
+        try:
+            export_folder_messages(sub_folder, output_dir, format, options=options,
+                                   folder_path=folder_path, checkpoint=checkpoint,
+                                   duplicates=duplicates, search_index=search_index)
+        except Exception as e:
+            logger.error(f"Error processing folder '{folder_path}': {e}")
+            logger.debug(traceback.format_exc())
+            raise
+
+def get_message_attachments(message) -> list:
+    """Return the attachments of a message without reading their data."""
+    if hasattr(message, 'attachments') and message.attachments:
+        return list(message.attachments)
+    return []
+
+def get_attachment_filename(attachment) -> str:
+    """Return the cleaned file name of an attachment, or a generic one."""
+    filename = None
+    if hasattr(attachment, 'name') and attachment.name:
+        filename = attachment.name
+    elif hasattr(attachment, 'get_name'):
+        filename = attachment.get_name()
+    
+    # If no filename, create a generic one
+    if not filename:
+        filename = f"attachment_{getattr(attachment, 'identifier', 'unknown')}"
+    
+    # Clean filename and ensure it's a string
+    filename = str(filename).strip()
+    return "".join(c for c in filename if c.isprintable() and c not in '\\/*?:"<>|')
+
+def scan_folder_tree(root_folders, attachments: bool = True) -> list:
+    """Index the folder tree without building any message.
+
+    Returns one entry per folder, in the order a serial export writes them,
+    with the folder path, its subfolder index path and its message count.
+    With ``attachments`` every message is opened to add up the number and
+    size of its attachments; no body or attachment data is read.
+    """
+    entries = []
+
+    def walk(folder, index_path, parent_path):
+        folder_name = get_folder_name(folder)
+        folder_path = f"{parent_path}/{folder_name}" if parent_path else str(folder_name)
+        try:
+            for i, subfolder in enumerate(get_sub_folders(folder)):
+                walk(subfolder, index_path + (i,), folder_path)
+        except Exception as e:
+            logger.warning(f"Could not scan subfolders in {folder_name}: {e}")
+
+        entry = {'path': folder_path, 'index': list(index_path), 'messages': count_messages(folder)}
+        if attachments:
+            count = size = 0
+            for message in iter_folder_messages(folder):
+                try:
+                    for attachment in get_message_attachments(message):
+                        count += 1
+                        size += getattr(attachment, 'size', 0) or 0
+                except Exception as e:
+                    logger.warning(f"Could not scan attachments in folder '{folder_path}': {e}")
+            entry['attachments'] = count
+            entry['attachment_bytes'] = size
+        entries.append(entry)
+
+    for i, root_folder in enumerate(root_folders):
+        walk(root_folder, (i,), '')
+    return entries
+
+def load_index(index_path: str, ost_path: str) -> Optional[dict]:
+    """Load a scan index, keyed by folder index path.
+
+    Returns None, with a warning, if the index was made from another version
+    of the OST file.
+    """
+    with open(index_path, encoding='utf-8') as f:
+        index = json.load(f)
+    stat = os.stat(ost_path)
+    if index.get('ost_size') != stat.st_size or index.get('ost_mtime') != int(stat.st_mtime):
+        logger.warning(f"Ignoring index {index_path}: it does not match {ost_path}")
+        return None
+    return {tuple(entry['index']): entry for entry in index['folders']}
+
+def folder_cost(entry: dict) -> int:
+    """Estimate the export cost of an indexed folder, in bytes of output."""
+    return entry['messages'] * MESSAGE_COST_BYTES + entry.get('attachment_bytes', 0)
+
+def plan_work_units(root_folders, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    index: Optional[dict] = None, target_cost: Optional[int] = None,
+                    message_filter: Optional[MessageFilter] = None) -> list:
+    """Split the folder tree into work units for the parallel export.
+
+    Each unit is a tuple ``(folder_index_path, folder_path, start, stop)`` where
+    ``folder_index_path`` locates the folder from the root folders by subfolder
+    index. Units are listed in the same order a serial run writes them, i.e.
+    subfolders before the messages of their parent folder.
+
+    With a scan ``index`` the tree is not walked again, and folders whose
+    estimated cost exceeds ``target_cost`` are split further so the units are
+    of similar size. Folders not selected by ``message_filter`` get no unit.
+    """
+    units = []
+
+    def add_units(index_path, folder_path, count, cost=None):
+        chunks = max(1, -(-count // chunk_size))
+        if cost is not None and target_cost:
+            chunks = max(chunks, min(count, -(-cost // target_cost)))
+        for k in range(chunks):
+            units.append((index_path, folder_path, count * k // chunks, count * (k + 1) // chunks))
+
+    if index is not None:
+        for index_path, entry in index.items():
+            if not message_filter or message_filter.folder_selected(entry['path']):
+                add_units(index_path, entry['path'], entry['messages'], folder_cost(entry))
+        return units
+
+    for folder, folder_path, index_path in walk_folders(root_folders, message_filter, subfolders_first=True):
+        if not message_filter or message_filter.folder_selected(folder_path):
+            add_units(index_path, folder_path, count_messages(folder))
+    return units
+
+def resolve_folder(ost_file, index_path):
+    """Return the folder located by a subfolder index path from the root folders."""
+    folders = get_root_folders(ost_file)
+    folder = None
+    for index in index_path:
+        folder = folders[index]
+        folders = get_sub_folders(folder)
+    return folder
+
+def _init_worker(ost_path: str, output_dir: str, options: ExportOptions,
+                 duplicates_path: Optional[str] = None):
+    """Open a private OST handle (and checkpoint store) in each worker process."""
+    global _worker_ost_file, _worker_checkpoint, _worker_duplicates, _worker_output_dir, _worker_search_index
+    global _progress
+    # Progress is reported by the parent as units are merged
+    _progress = None
+    _worker_output_dir = output_dir
+    _worker_ost_file = pypff.file()
+    _worker_ost_file.open(ost_path)
+    if options.checkpoint:
+        _worker_checkpoint = CheckpointStore(output_dir)
+    if options.dedup_messages:
+        if _worker_checkpoint is not None:
+            _worker_duplicates = _worker_checkpoint.duplicate_index()
+        else:
+            _worker_duplicates = DuplicateIndex.open(output_dir, duplicates_path)
+    if options.search_index:
+        _worker_search_index = SearchIndex(output_dir)
+
+def _unit_id(unit_dir: str) -> str:
+    """Return the id under which a work unit records its checkpoints."""
+    return os.path.join(os.path.basename(os.path.dirname(unit_dir)), os.path.basename(unit_dir))
+
+def _export_work_unit(task):
+    """Export one work unit into its own staging directory.
+
+    Maildir units are written straight to the output directory instead, since
+    deliveries are atomic, and their checkpoint records are final at once.
+    Returns the task and a snapshot of the metrics of the unit.
+    """
+    unit_dir, unit, format, options = task
+    index_path, folder_path, start, stop = unit
+    target_dir, unit_id = unit_dir, _unit_id(unit_dir)
+    if format == 'maildir':
+        target_dir, unit_id = _worker_output_dir, None
+    METRICS.reset()
+    try:
+        folder = resolve_folder(_worker_ost_file, index_path)
+        os.makedirs(target_dir, exist_ok=True)
+        export_folder_messages(folder, target_dir, format, start, stop, options,
+                               folder_path, _worker_checkpoint, unit_id, _worker_duplicates,
+                               _worker_search_index)
+    except Exception as e:
+        logger.error(f"Error processing folder '{folder_path}': {e}")
+        logger.debug(traceback.format_exc())
+    return task, METRICS.snapshot()
+
+def _merge_work_unit(unit_dir: str, output_dir: str, format: str,
+                     checkpoint: Optional[CheckpointStore] = None,
+                     options: Optional[ExportOptions] = None,
+                     search_index: Optional[SearchIndex] = None):
+    """Move the output of a finished work unit into the output directory.
+
+    Compressed MBOX parts are appended as they are, as gzip members or zstd
+    frames. The entries of zip archives are added to the target archive, which
+    compresses them again.
+    """
+    options = options or ExportOptions()
+    if not os.path.isdir(unit_dir):
+        return
+    base_offset = 0
+    for entry in sorted(os.listdir(unit_dir)):
+        part_path = os.path.join(unit_dir, entry)
+        target_path = os.path.join(output_dir, entry)
+        if format == 'mbox':
+            with open(part_path, 'rb') as part_file, open(target_path, 'ab') as target_file:
+                base_offset = target_file.tell()
+                if checkpoint:
+                    # Until release_unit, recover drops the appended part
+                    checkpoint.start_file(entry, base_offset)
+                shutil.copyfileobj(part_file, target_file, 1024 * 1024)
+        elif format == 'eml' and os.path.isfile(part_path):
+            with zipfile.ZipFile(part_path) as part_zip, \
+                    ZipEmlWriter(target_path, options.compression_level, options.mbox_buffer_size,
+                                 spool_size=options.attachment_buffer_size) as target_zip:
+                for info in part_zip.infolist():
+                    with part_zip.open(info) as entry:
+                        target_zip.copy(info.filename, entry)
+        elif format == 'eml':
+            for dirpath, _, filenames in os.walk(part_path):
+                target_dir = os.path.join(target_path, os.path.relpath(dirpath, part_path))
+                os.makedirs(target_dir, exist_ok=True)
+                for filename in filenames:
+                    os.replace(os.path.join(dirpath, filename), os.path.join(target_dir, filename))
+    if checkpoint:
+        checkpoint.release_unit(_unit_id(unit_dir), base_offset)
+    if search_index is not None:
+        search_index.release_unit(_unit_id(unit_dir), base_offset)
+    shutil.rmtree(unit_dir, ignore_errors=True)
+
+def export_parallel(ost_path: str, root_folders, output_dir: str, format: str = 'mbox',
+                    jobs: int = 2, preserve_order: bool = True,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    options: Optional[ExportOptions] = None,
+                    checkpoint: Optional[CheckpointStore] = None,
+                    index: Optional[dict] = None,
+                    search_index: Optional[SearchIndex] = None):
+    """Export the folder tree using a pool of worker processes.
+
+    Every work unit is written to a private staging directory and merged into
+    the output directory by this process, except for Maildir output, which the
+    workers deliver directly. With ``preserve_order`` the units are
+    merged in serial order, so the result matches a serial run; otherwise they
+    are merged as soon as they finish.
+
+    With a scan ``index`` large folders are split into units of similar cost
+    and the most expensive units are started first.
+    """
+    options = options or ExportOptions()
+    target_cost = None
+    if index is not None:
+        target_cost = max(1, sum(folder_cost(entry) for entry in index.values()) // (jobs * UNITS_PER_JOB))
+    units = plan_work_units(root_folders, chunk_size, index, target_cost, options.message_filter)
+    logger.info(f"Exporting {len(units)} work units with {jobs} jobs")
+
+    staging_dir = tempfile.mkdtemp(prefix='.ost_export-', dir=output_dir)
+    # Without checkpoints the workers share a duplicate index for this run only
+    duplicates_path = os.path.join(staging_dir, 'duplicates.sqlite')
+    tasks = [(os.path.join(staging_dir, str(i)), unit, format, options)
+             for i, unit in enumerate(units)]
+
+    # Longest units first, so no worker is left with a big one at the end
+    order = list(range(len(tasks)))
+    if index is not None:
+        def unit_cost(i):
+            index_path, _, start, stop = units[i]
+            entry = index[index_path]
+            return folder_cost(entry) * (stop - start) // max(1, entry['messages'])
+        order.sort(key=unit_cost, reverse=True)
+
+    try:
+        with multiprocessing.Pool(jobs, initializer=_init_worker,
+                                  initargs=(ost_path, output_dir, options, duplicates_path)) as pool:
+            if preserve_order:
+                pending = [None] * len(tasks)
+                for i in order:
+                    pending[i] = pool.apply_async(_export_work_unit, (tasks[i],))
+                finished = (result.get() for result in pending)
+            else:
+                finished = pool.imap_unordered(_export_work_unit, [tasks[i] for i in order])
+            for (unit_dir, unit, _, _), snapshot in finished:
+                _merge_work_unit(unit_dir, output_dir, format, checkpoint, options, search_index)
+                METRICS.merge(snapshot)
+                _report_progress(unit[3] - unit[2])
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+def count_tree_messages(root_folders, message_filter: Optional[MessageFilter] = None) -> int:
+    """Return the number of messages below the given folders without reading them.
+
+    Only the folders selected by ``message_filter`` are counted.
+    """
+    total = 0
+    for folder, folder_path, _ in walk_folders(root_folders, message_filter):
+        if message_filter and not message_filter.folder_selected(folder_path):
+            continue
+        try:
+            total += count_messages(folder)
+        except Exception as e:
+            logger.warning(f"Could not count messages in {folder_path}: {e}")
+    return total
+
+def write_metrics_summary(path: str, summary: dict):
+    """Write the JSON summary of an export run."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+        f.write('\n')
+
+def export_ost(ost_path: str, output_dir: str, format: str = 'mbox', jobs: int = 1,
+               preserve_order: bool = True, chunk_size: int = DEFAULT_CHUNK_SIZE,
+               options: Optional[ExportOptions] = None, progress: bool = False,
+               metrics_path: Optional[str] = None, index_path: Optional[str] = None):
+    """Export OST file to MBOX, EML or Maildir format.
+
+    Raises ``OstExportError`` when the OST file cannot be exported. With
+    ``progress`` a status line with the ETA is shown on stderr, and with
+    ``metrics_path`` the per-stage metrics of the run are written there as JSON.
+    ``index_path`` is a file made by ``scan_ost``, used to balance the parallel
+    export and for the progress total.
+    """
+    global _progress
+    options = options or ExportOptions()
+    if options.checkpoint and options.compression != 'none':
+        raise OstExportError("Checkpoints need uncompressed output")
+    started = time.perf_counter()
+    METRICS.reset()
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    checkpoint = None
+    search_index = None
+    try:
+        if options.checkpoint:
+            checkpoint = CheckpointStore(output_dir)
+            checkpoint.recover()
+        if options.search_index:
+            search_index = SearchIndex(output_dir)
+            search_index.recover()
+        
+        index = load_index(index_path, ost_path) if index_path else None
+        
+        # Open OST file
+        ost_file = pypff.file()
+        try:
+            ost_file.open(ost_path)
+            
+            # Get root folders
+            root_folders = get_root_folders(ost_file)
+            
+            if not root_folders:
+                logger.error("No root folders found in the OST file")
+                return
+            
+            if progress:
+                message_filter = options.message_filter
+                if index is not None:
+                    total = sum(entry['messages'] for entry in index.values()
+                                if not message_filter or message_filter.folder_selected(entry['path']))
+                else:
+                    total = count_tree_messages(root_folders, message_filter)
+                _progress = ProgressReporter(total)
+                
+            if format == 'maildir':
+                create_maildir(output_dir, subfolder=False)
+            
+            if jobs > 1:
+                export_parallel(ost_path, root_folders, output_dir, format,
+                                jobs, preserve_order, chunk_size, options, checkpoint, index, search_index)
+            else:
+                duplicates = None
+                if options.dedup_messages:
+                    duplicates = checkpoint.duplicate_index() if checkpoint else DuplicateIndex(output_dir)
+                
+                # Process each root folder
+                for root_folder in root_folders:
+                    process_folder(root_folder, output_dir, format, options, checkpoint,
+                                   duplicates=duplicates, search_index=search_index)
+                
+        except Exception as e:
+            logger.error(f"Error processing OST file: {e}")
+            logger.debug(traceback.format_exc())
+            raise
+            
+        finally:
+            if _progress is not None:
+                _progress.finish()
+                _progress = None
+            if hasattr(ost_file, 'close'):
+                ost_file.close()
+            if checkpoint:
+                checkpoint.close()
+            if search_index is not None:
+                search_index.close()
+        logger.info(f"Conversion completed successfully! Files saved in: {output_dir}")
+        if options.dedup_messages:
+            logger.info(f"Found {METRICS.counters['duplicates']} duplicate messages")
+        
+        if metrics_path:
+            summary = METRICS.summary(time.perf_counter() - started)
+            summary.update({'ost_path': ost_path, 'output_dir': output_dir, 'format': format, 'jobs': jobs})
+            write_metrics_summary(metrics_path, summary)
+        
+    except Exception as e:
+        if hasattr(e, '__module__') and e.__module__.startswith('pypff'):
+            logger.error(f"Error processing OST file (pypff error): {e}")
+        else:
+            logger.error(f"Unexpected error: {e}")
+        logger.debug(traceback.format_exc())
+        raise OstExportError(str(e)) from e
+
+def find_ost_files(inputs) -> list:
+    """Return the OST files given as paths, searching directories recursively.
+
+    Directories are searched for files with an extension in ``OST_EXTENSIONS``;
+    files given explicitly are kept whatever their extension.
+    """
+    ost_paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                ost_paths.extend(os.path.join(dirpath, filename) for filename in sorted(filenames)
+                                 if filename.lower().endswith(OST_EXTENSIONS))
+        else:
+            ost_paths.append(path)
+    # The same file may be found through several inputs
+    seen = set()
+    return [path for path in ost_paths
+            if os.path.realpath(path) not in seen and not seen.add(os.path.realpath(path))]
+
+def physical_memory() -> Optional[int]:
+    """Return the physical memory of the host in bytes, or None if it is unknown."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def estimate_export_memory(ost_size: int, options: Optional[ExportOptions] = None) -> int:
+    """Return the memory assumed for exporting an OST file of ``ost_size`` bytes."""
+    options = options or ExportOptions()
+    return (BATCH_BASE_MEMORY + int(ost_size * BATCH_MEMORY_RATIO)
+            + options.attachment_buffer_size + options.mbox_buffer_size)
+
+def _export_batch_file(ost_path: str, output_dir: str, format: str, options: ExportOptions) -> dict:
+    """Export one OST file of a batch in a worker process; return its report entry."""
+    if options.attachment_store:
+        options.attachment_store = os.path.abspath(os.path.join(output_dir, ATTACHMENT_STORE_DIRNAME))
+    started = time.perf_counter()
+    result = {'status': 'ok', 'error': None}
+    try:
+        export_ost(ost_path, output_dir, format, options=options)
+    except Exception as e:
+        result.update(status='failed', error=str(e))
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    result['counters'] = dict(METRICS.counters)
+    return result
+
+def export_batch(ost_paths, output_dir: str, format: str = 'mbox', jobs: int = 1,
+                 memory_budget: Optional[int] = None, options: Optional[ExportOptions] = None,
+                 report_path: Optional[str] = None) -> dict:
+    """Export many OST files, each into its own subdirectory of ``output_dir``.
+
+    Up to ``jobs`` files are exported at once by a pool of worker processes,
+    largest files first. Every export is assumed to need the memory given by
+    ``estimate_export_memory``, and a file only starts when its share fits in
+    what ``memory_budget`` has left; a file larger than the whole budget runs
+    alone. A failed file does not stop the others. The report, also written as
+    JSON to ``report_path`` (by default ``BATCH_REPORT_FILENAME`` in the
+    output directory), has an entry for every file in the order given.
+
+    A worker process that dies breaks the whole pool, so the files running at
+    that time are exported again one at a time, each alone in a new pool, and
+    only a file whose worker dies again that way is reported as failed. With
+    checkpoints the new export resumes the interrupted one; otherwise the
+    output directory of the file is emptied first.
+
+    With an attachment store in the options, every file gets the store of its
+    own output directory.
+    """
+    options = options or ExportOptions()
+    started = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = report_path or os.path.join(output_dir, BATCH_REPORT_FILENAME)
+
+    # Output directories are named after the files, numbered if names repeat
+    entries = []
+    names = set()
+    for ost_path in ost_paths:
+        base = os.path.splitext(os.path.basename(ost_path))[0] or 'mailbox'
+        name = base
+        number = 1
+        while name.lower() in names:
+            number += 1
+            name = f"{base}_{number}"
+        names.add(name.lower())
+        entry = {'ost_path': ost_path, 'output_dir': os.path.join(output_dir, name), 'size': None,
+                 'status': 'pending', 'error': None}
+        try:
+            entry['size'] = os.path.getsize(ost_path)
+        except OSError as e:
+            entry.update(status='failed', error=str(e))
+        entries.append(entry)
+
+    pending = sorted((entry for entry in entries if entry['status'] == 'pending'),
+                     key=lambda entry: entry['size'], reverse=True)
+    logger.info(f"Exporting {len(pending)} OST files with {jobs} jobs"
+                 + (f" and a memory budget of {memory_budget // (1024 * 1024)} MB" if memory_budget else ""))
+    # Files that were running when a worker died, to be exported again alone
+    suspects = []
+    running = {}
+    reserved = 0
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+
+    def start(entry, memory, alone=False):
+        logger.info(f"Starting {entry['ost_path']} ({entry['size'] // (1024 * 1024)} MB)"
+                    + (" alone" if alone else ""))
+        if alone and not options.checkpoint:
+            # The output of the interrupted export would stay in the MBOX files
+            shutil.rmtree(entry['output_dir'], ignore_errors=True)
+        future = executor.submit(_export_batch_file, entry['ost_path'], entry['output_dir'],
+                                 format, options)
+        running[future] = (entry, memory, alone)
+
+    try:
+        while pending or running or suspects:
+            if suspects:
+                if not running:
+                    entry = suspects.pop(0)
+                    start(entry, estimate_export_memory(entry['size'], options), alone=True)
+            else:
+                # Start the largest files whose memory fits in the budget left
+                for entry in list(pending):
+                    if len(running) >= jobs:
+                        break
+                    memory = estimate_export_memory(entry['size'], options)
+                    if memory_budget is not None and running and reserved + memory > memory_budget:
+                        continue
+                    pending.remove(entry)
+                    reserved += memory
+                    start(entry, memory)
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                entry, memory, alone = running.pop(future)
+                if not alone:
+                    reserved -= memory
+                try:
+                    entry.update(future.result())
+                except concurrent.futures.process.BrokenProcessPool as e:
+                    # The worker died, for instance killed for lack of memory,
+                    # but it may have been the worker of another file
+                    broken = True
+                    if not alone:
+                        suspects.append(entry)
+                        continue
+                    entry.update(status='failed', error=f"worker process failed: {e!r}")
+                except Exception as e:
+                    entry.update(status='failed', error=f"worker process failed: {e!r}")
+                if entry['status'] == 'ok':
+                    logger.info(f"Finished {entry['ost_path']}: {entry['counters'].get('messages', 0)} messages "
+                                 f"in {entry['seconds']:.1f}s")
+                else:
+                    logger.error(f"Failed to export {entry['ost_path']}: {entry['error']}")
+            if broken:
+                # Every other future of the pool fails as well
+                for entry, memory, alone in running.values():
+                    if not alone:
+                        reserved -= memory
+                    suspects.append(entry)
+                running.clear()
+                if suspects:
+                    logger.warning(f"A worker process died; exporting {len(suspects)} files again one at a time")
+                executor.shutdown(wait=True)
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    finally:
+        executor.shutdown(wait=True)
+
+    failed = sum(1 for entry in entries if entry['status'] != 'ok')
+    report = {
+        'format': format,
+        'output_dir': output_dir,
+        'seconds': round(time.perf_counter() - started, 3),
+        'files': len(entries),
+        'succeeded': len(entries) - failed,
+        'failed': failed,
+        'messages': sum(entry.get('counters', {}).get('messages', 0) for entry in entries),
+        'results': entries,
+    }
+    write_metrics_summary(report_path, report)
+    logger.info(f"Exported {report['succeeded']} of {len(entries)} OST files; report saved in: {report_path}")
+    return report
+
+class AttachmentHandle:
+    """An attachment of a ``MessageRecord`` whose data is read on demand.
+
+    The data is read from the OST file, so the iterator that made the record
+    must still be open.
+    """
+
+    __slots__ = ('name', 'size', 'content_type', '_attachment', '_executor')
+
+    def __init__(self, attachment, executor: Optional[concurrent.futures.Executor] = None):
+        self.name = get_attachment_filename(attachment)
+        self.size = getattr(attachment, 'size', 0) or 0
+        file_ext = self.name.rsplit('.', 1)[1].lower() if '.' in self.name else ''
+        self.content_type = ATTACHMENT_MIME_TYPES.get(file_ext, 'application/octet-stream')
+        self._attachment = attachment
+        self._executor = executor
+
+    def __repr__(self):
+        return f"AttachmentHandle({self.name!r}, {self.size}, {self.content_type!r})"
+
+    def iter_chunks(self, chunk_size: int = DEFAULT_ATTACHMENT_BUFFER_SIZE):
+        """Yield the data of the attachment ``chunk_size`` bytes at a time."""
+        if hasattr(self._attachment, 'seek_offset'):
+            self._attachment.seek_offset(0)
+        remaining = self.size
+        while remaining > 0:
+            chunk = self._attachment.read_buffer(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def read(self) -> bytes:
+        """Return the whole data of the attachment."""
+        return b''.join(self.iter_chunks(max(1, self.size)))
+
+    async def read_async(self) -> bytes:
+        """Read the data on the thread of ``aiter_messages`` that reads the OST file."""
+        return await _get_running_loop().run_in_executor(self._executor, self.read)
+
+class MessageRecord:
+    """A message of an OST file, without any MIME structure.
+
+    ``body`` is the plain text body, or the text of the HTML body when the
+    message has no plain text; ``html_body`` is None for plain text messages.
+    ``headers`` holds the transport headers of received messages, or ''.
+    """
+
+    __slots__ = ('folder_path', 'identifier', 'delivery_time', 'subject', 'sender', 'to', 'cc',
+                 'headers', 'body', 'html_body', 'attachments')
+
+    def __init__(self, message, folder_path: str, html_to_text: str = 'fast'):
+        self.folder_path = folder_path
+        self.identifier, _ = get_message_key(message)
+        self.delivery_time = getattr(message, 'delivery_time', None)
+        self.subject = str(getattr(message, 'subject', None) or '')
+        self.sender = str(getattr(message, 'sender_name', None) or '')
+        self.to = str(getattr(message, 'display_to', None) or '')
+        self.cc = str(getattr(message, 'display_cc', None) or '')
+        self.headers = self._text(getattr(message, 'transport_headers', None))
+        self.html_body = self._text(getattr(message, 'html_body', None)) or None
+        self.body = self._text(getattr(message, 'plain_text_body', None))
+        if not self.body and self.html_body:
+            converter = HTML_TO_TEXT_CONVERTERS.get(html_to_text)
+            if converter is not None:
+                try:
+                    self.body = converter(self.html_body)
+                except Exception as e:
+                    logger.warning(f"Error converting HTML body to text: {e}")
+        self.attachments = [AttachmentHandle(attachment) for attachment in get_message_attachments(message)
+                            if hasattr(attachment, 'read_buffer')]
+
+    @staticmethod
+    def _text(value) -> str:
+        if isinstance(value, bytes):
+            return value.decode('utf-8', errors='replace')
+        return str(value) if value else ''
+
+    def __repr__(self):
+        return f"MessageRecord({self.folder_path!r}, {self.identifier!r}, {self.subject!r})"
+
+def iter_folders(root_folders, message_filter: Optional[MessageFilter] = None):
+    """Yield ``(folder, folder_path)`` for every folder below ``root_folders``.
+
+    Parents come before their subfolders. Folders excluded by
+    ``message_filter`` are skipped with their subfolders.
+    """
+    for folder, folder_path, _ in walk_folders(root_folders, message_filter):
+        yield folder, folder_path
+
+def iter_messages(ost_path: str, message_filter: Optional[MessageFilter] = None,
+                  html_to_text: str = 'fast'):
+    """Yield a ``MessageRecord`` for every message of an OST file.
+
+    Messages are read one at a time, folder by folder, and only the messages
+    selected by ``message_filter`` are yielded. Attachment data is only read
+    through the handles of a record, while the iterator is open; closing the
+    iterator closes the OST file. Raises ``OstExportError`` when the file
+    cannot be opened.
+    """
+    ost_file = pypff.file()
+    try:
+        ost_file.open(ost_path)
+        root_folders = get_root_folders(ost_file)
+    except Exception as e:
+        logger.error(f"Error opening OST file: {e}")
+        raise OstExportError(str(e)) from e
+    try:
+        for folder, folder_path in iter_folders(root_folders, message_filter):
+            if message_filter and not message_filter.folder_selected(folder_path):
+                continue
+            for message in iter_folder_messages(folder):
+                try:
+                    if not message:
+                        continue
+                    if message_filter and not message_filter.message_selected(message):
+                        continue
+                    record = MessageRecord(message, folder_path, html_to_text)
+                except Exception as e:
+                    logger.error(f"Error reading message in folder '{folder_path}': {e}")
+                    continue
+                yield record
+    finally:
+        if hasattr(ost_file, 'close'):
+            ost_file.close()
+
+async def aiter_messages(ost_path: str, message_filter: Optional[MessageFilter] = None,
+                         html_to_text: str = 'fast', prefetch: int = 16,
+                         executor: Optional[concurrent.futures.Executor] = None):
+    """Asynchronous version of ``iter_messages`` for asyncio pipelines.
+
+    The OST file is read on ``executor``, by default a private thread, so the
+    event loop is never blocked. pypff handles must not be shared between
+    threads, so a given executor must run one task at a time. At most
+    ``prefetch`` records are read ahead of the consumer; a slow consumer holds
+    back the reads. Read attachments with ``await handle.read_async()``, which
+    runs on the same thread.
+    """
+    loop = _get_running_loop()
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    records = iter_messages(ost_path, message_filter, html_to_text)
+    ready = asyncio.Queue(maxsize=max(1, prefetch))
+    end = object()
+
+    async def read_records():
+        try:
+            while True:
+                record = await loop.run_in_executor(executor, next, records, end)
+                if record is not end:
+                    for handle in record.attachments:
+                        handle._executor = executor
+                await ready.put(record)
+                if record is end:
+                    return
+        except Exception as e:
+            await ready.put(e)
+
+    reader = asyncio.ensure_future(read_records())
+    try:
+        while True:
+            record = await ready.get()
+            if record is end:
+                return
+            if isinstance(record, Exception):
+                raise record
+            yield record
+    finally:
+        reader.cancel()
+        # Runs after any read still in progress, on the same thread
+        await loop.run_in_executor(executor, records.close)
+        if own_executor:
+            executor.shutdown(wait=False)
+
+def scan_ost(ost_path: str, index_path: str, attachments: bool = True) -> dict:
+    """Write an index of the folder tree of an OST file to ``index_path``.
+
+    The index lists every folder with its message count and, with
+    ``attachments``, the number and total size of its attachments. It is much
+    faster than an export since no message is built. Pass it to ``export_ost``
+    to balance the parallel export and to show accurate progress. Raises
+    ``OstExportError`` when the OST file cannot be read.
+    """
+    started = time.perf_counter()
+    try:
+        ost_file = pypff.file()
+        try:
+            ost_file.open(ost_path)
+            folders = scan_folder_tree(get_root_folders(ost_file), attachments)
+        finally:
+            if hasattr(ost_file, 'close'):
+                ost_file.close()
+        
+        stat = os.stat(ost_path)
+        index = {
+            'version': 1,
+            'ost_path': os.path.abspath(ost_path),
+            'ost_size': stat.st_size,
+            'ost_mtime': int(stat.st_mtime),
+            'folders': folders,
+        }
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, separators=(',', ':'))
+        
+        messages = sum(entry['messages'] for entry in folders)
+        attachment_bytes = sum(entry.get('attachment_bytes', 0) for entry in folders)
+        logger.info(f"Scanned {len(folders)} folders, {messages} messages and {attachment_bytes} "
+                     f"attachment bytes in {time.perf_counter() - started:.1f}s. Index saved in: {index_path}")
+        return index
+    
+    except Exception as e:
+        logger.error(f"Error scanning OST file: {e}")
+        logger.debug(traceback.format_exc())
+        raise OstExportError(str(e)) from e
+
+def parse_date(value: str) -> datetime:
+    """Parse a ``YYYY-MM-DD`` or ``YYYY-MM-DDTHH:MM[:SS]`` command line date."""
+    for date_format in ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M'):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"invalid date: {value!r} (expected YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)")
+
+def parse_end_date(value: str) -> datetime:
+    """Parse the end of a date range; a plain date includes the whole day."""
+    date = parse_date(value)
+    if len(value) == len('YYYY-MM-DD'):
+        date += timedelta(days=1)
+    return date
+
+def parse_size(value: str) -> int:
+    """Parse a command line size in bytes, with an optional K, M, G or T suffix."""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?', value.strip(), re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r} (expected a number of bytes such as 512M or 16G)")
+    return int(float(match.group(1)) * 1024 ** ' KMGT'.index(match.group(2).upper() or ' '))
+
+def parse_regex(value: str) -> str:
+    """Check that a command line pattern is a valid regular expression."""
+    try:
+        re.compile(value)
+    except re.error as e:
+        raise argparse.ArgumentTypeError(f"invalid regular expression {value!r}: {e}")
+    return value
+
+def add_export_arguments(parser: argparse.ArgumentParser):
+    """Add the export options shared by the single file and batch modes."""
+    parser.add_argument('--flush-every', type=int, default=0,
+                        help="flush MBOX files every N messages (default: only when a folder is done)")
+    parser.add_argument('--fsync', choices=MboxWriter.FSYNC_POLICIES, default='never',
+                        help="when to fsync MBOX files: never, on close, or on every flush; anything but "
+                             "never fsyncs every Maildir message before it is moved to new/ (default: never)")
+    parser.add_argument('--attachment-buffer', type=int, default=DEFAULT_ATTACHMENT_BUFFER_SIZE,
+                        help="memory budget in bytes for reading one attachment; larger attachments "
+                             f"are streamed in chunks of this size (default: {DEFAULT_ATTACHMENT_BUFFER_SIZE})")
+    parser.add_argument('--checkpoint', action='store_true',
+                        help="record exported messages in the output directory; reruns resume an "
+                             "interrupted export and only export new messages")
+    parser.add_argument('--html-to-text', choices=list(HTML_TO_TEXT_CONVERTERS), default='fast',
+                        help="converter for the plain text alternative of HTML messages; "
+                             "'none' only keeps the HTML part (default: fast)")
+    parser.add_argument('--line-endings', choices=list(LINE_ENDINGS),
+                        help="line endings of the exported messages (default: crlf for mbox, lf for eml and maildir)")
+    parser.add_argument('--dedup-attachments', action='store_true',
+                        help=f"store each distinct attachment once in {ATTACHMENT_STORE_DIRNAME}/ in the output "
+                             "directory and refer to it from the messages")
+    parser.add_argument('--eml-layout', choices=EML_LAYOUTS,
+                        help="EML files of a folder: 'flat' (default) names them after the subject; 'hash' "
+                             "and 'date' use unique names in hashed or YYYY/MM subdirectories")
+    parser.add_argument('--dedup-messages', choices=DEDUP_MODES,
+                        help="find messages already exported from another folder and skip them, or "
+                             "link them (hard links for EML and Maildir files, short reference messages otherwise)")
+    parser.add_argument('--search-index', action='store_true',
+                        help=f"index the headers, text and attachment names of the exported messages in "
+                             f"{SEARCH_INDEX_FILENAME} (SQLite FTS5) in the output directory")
+    parser.add_argument('--compress', choices=['none', 'gzip', 'zstd', 'zip'], default='none',
+                        help="compress MBOX files with gzip or zstd, or write the EML files of each "
+                             "folder into a zip archive (default: none)")
+    parser.add_argument('--compress-level', type=int, metavar='LEVEL',
+                        help="compression level (default: 6 for gzip and zip, 3 for zstd)")
+    filters = parser.add_argument_group('filters', "only export the folders and messages that match")
+    filters.add_argument('--include-folder', action='append', metavar='GLOB',
+                         help="export the messages of folders whose path (e.g. 'Top/Inbox/*') matches; "
+                              "can be repeated")
+    filters.add_argument('--exclude-folder', action='append', metavar='GLOB',
+                         help="skip folders whose path matches, with their subfolders; can be repeated")
+    filters.add_argument('--since', type=parse_date, metavar='DATE',
+                         help="only messages delivered on or after DATE (UTC, YYYY-MM-DD[THH:MM:SS])")
+    filters.add_argument('--until', type=parse_end_date, metavar='DATE',
+                         help="only messages delivered before the end of DATE, or before DATE if it has a time")
+    filters.add_argument('--sender', type=parse_regex, metavar='REGEX',
+                         help="only messages whose sender matches REGEX (ignoring case)")
+    filters.add_argument('--subject', type=parse_regex, metavar='REGEX',
+                         help="only messages whose subject matches REGEX (ignoring case)")
+    filters.add_argument('--max-attachment-size', type=parse_size, metavar='SIZE',
+                         help="skip messages with an attachment larger than SIZE, such as 10M")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="log details about every attachment")
+
+def export_options_from_args(parser: argparse.ArgumentParser, args) -> ExportOptions:
+    """Check the arguments added by ``add_export_arguments`` and return the export options.
+
+    The attachment store is left to the caller, since it lives in the output directory.
+    """
+    if args.attachment_buffer < ATTACHMENT_HEAD_SIZE:
+        parser.error(f"--attachment-buffer must be at least {ATTACHMENT_HEAD_SIZE}")
+    if args.html_to_text not in available_html_to_text_converters():
+        parser.error(f"--html-to-text {args.html_to_text} needs the {args.html_to_text} package to be installed")
+    if args.compress in COMPRESSION_SUFFIXES and args.format != 'mbox':
+        parser.error(f"--compress {args.compress} is only available for mbox; use --compress zip for eml")
+    if args.compress == 'zip' and args.format != 'eml':
+        parser.error("--compress zip is only available for eml; use --compress gzip or zstd for mbox")
+    if args.compress == 'zstd' and zstandard is None:
+        parser.error("--compress zstd needs the zstandard package to be installed")
+    if args.compress_level is not None:
+        if args.compress == 'none':
+            parser.error("--compress-level needs --compress")
+        high = 22 if args.compress == 'zstd' else 9
+        if not 0 <= args.compress_level <= high:
+            parser.error(f"--compress-level must be between 0 and {high} for {args.compress}")
+    if args.checkpoint and args.compress != 'none':
+        parser.error("--checkpoint cannot be combined with --compress")
+    if args.eml_layout and args.format != 'eml':
+        parser.error("--eml-layout is only available for eml")
+    if args.search_index and not fts5_available():
+        parser.error("--search-index needs an SQLite library with the FTS5 extension")
+
+    message_filter = None
+    if any(value is not None for value in (args.include_folder, args.exclude_folder, args.since, args.until,
+                                           args.sender, args.subject, args.max_attachment_size)):
+        message_filter = MessageFilter(args.include_folder, args.exclude_folder, args.since, args.until,
+                                       args.sender, args.subject, args.max_attachment_size)
+
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    return ExportOptions(flush_every=args.flush_every, fsync=args.fsync,
+                         attachment_buffer_size=args.attachment_buffer,
+                         checkpoint=args.checkpoint, html_to_text=args.html_to_text,
+                         compression=args.compress, compression_level=args.compress_level,
+                         message_filter=message_filter, line_endings=args.line_endings,
+                         dedup_messages=args.dedup_messages, eml_layout=args.eml_layout or 'flat',
+                         search_index=args.search_index)
+
+def batch_main(argv):
+    """Command line entry point of the ``batch`` mode."""
+    parser = argparse.ArgumentParser(
+        prog='ost_export.py batch',
+        description="Export many OST files, each into its own subdirectory of the output directory, "
+                    "with a pool of worker processes.")
+    parser.add_argument('inputs', nargs='+', metavar='ost_file_or_directory',
+                        help=f"OST files, or directories searched for {' and '.join(OST_EXTENSIONS)} files")
+    parser.add_argument('output_dir', metavar='output_directory', help="directory for the exported files")
+    parser.add_argument('format', type=str.lower, choices=['mbox', 'eml', 'maildir'], help="export format")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of OST files exported at once (default: 1)")
+    parser.add_argument('--memory-budget', type=parse_size, metavar='SIZE',
+                        help="memory for all the exports running at once, such as 16G; larger files "
+                             "wait until enough of it is free (default: half of the physical memory)")
+    parser.add_argument('--report', metavar='PATH',
+                        help=f"JSON report of every file (default: {BATCH_REPORT_FILENAME} in the output directory)")
+    add_export_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    for path in args.inputs:
+        if not os.path.exists(path):
+            parser.error(f"{path} does not exist")
+    options = export_options_from_args(parser, args)
+    if args.dedup_attachments:
+        # Every file gets the store of its own output directory
+        options.attachment_store = ATTACHMENT_STORE_DIRNAME
+    ost_paths = find_ost_files(args.inputs)
+    if not ost_paths:
+        parser.error("no OST or PST files found")
+    memory_budget = args.memory_budget
+    if memory_budget is None and physical_memory():
+        memory_budget = physical_memory() // 2
+    report = export_batch(ost_paths, args.output_dir, args.format, args.jobs, memory_budget,
+                          options, args.report)
+    if report['failed']:
+        sys.exit(1)
+
+def search_main(argv):
+    """Command line entry point of the ``search`` mode."""
+    parser = argparse.ArgumentParser(
+        prog='ost_export.py search',
+        description="Search the messages indexed with --search-index during an export.")
+    parser.add_argument('output_dir', metavar='output_directory',
+                        help=f"output directory of the export, holding {SEARCH_INDEX_FILENAME}")
+    parser.add_argument('query', help="FTS5 query, such as 'budget AND sender:alice' or '\"status report\"'")
+    parser.add_argument('--limit', type=int, default=20, help="maximum number of results (default: 20)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(os.path.join(args.output_dir, SEARCH_INDEX_FILENAME)):
+        parser.error(f"no {SEARCH_INDEX_FILENAME} in {args.output_dir}")
+    search_index = SearchIndex(args.output_dir)
+    try:
+        results = search_index.search(args.query, args.limit)
+    except sqlite3.OperationalError as e:
+        parser.error(f"invalid query: {e}")
+    finally:
+        search_index.close()
+    for result in results:
+        location = result['output_path']
+        if result['offset'] is not None:
+            location += f" @{result['offset']}+{result['length']}"
+        print(f"{location}\t{result['delivery_time']}\t{result['sender']}\t{result['subject']}")
+
+def scan_main(argv):
+    """Command line entry point of the ``scan`` mode."""
+    parser = argparse.ArgumentParser(
+        prog='ost_export.py scan',
+        description="Index the folders of an OST file (message counts and attachment sizes) "
+                    "without exporting anything.")
+    parser.add_argument('ost_path', metavar='ost_file', help="path to the OST file")
+    parser.add_argument('index_path', metavar='index_file', help="index file to write (JSON)")
+    parser.add_argument('--no-attachments', dest='attachments', action='store_false',
+                        help="only count messages; do not open them to sum up attachment sizes")
+    args = parser.parse_args(argv)
+    try:
+        scan_ost(args.ost_path, args.index_path, args.attachments)
+    except OstExportError:
         sys.exit(1)
+
+def main(argv=None):
+    """Command line entry point."""
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == 'scan':
+        return scan_main(argv[1:])
+    if argv and argv[0] == 'batch':
+        return batch_main(argv[1:])
+    if argv and argv[0] == 'search':
+        return search_main(argv[1:])
     
-    export_ost(ost_path, output_dir, format)
+    parser = argparse.ArgumentParser(
+        prog='ost_export.py',
+        description="Export emails and attachments from an Outlook OST file to MBOX, EML or Maildir format.",
+        epilog="Use 'ost_export.py scan <ost_file> <index_file>' to index an OST file before exporting it, "
+               "'ost_export.py batch' to export many OST files, and 'ost_export.py search' to search "
+               "an export made with --search-index.")
+    parser.add_argument('ost_path', metavar='ost_file', help="path to the OST file")
+    parser.add_argument('output_dir', metavar='output_directory', help="directory for the exported files")
+    parser.add_argument('format', type=str.lower, choices=['mbox', 'eml', 'maildir'], help="export format")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of worker processes (default: 1)")
+    parser.add_argument('--no-preserve-order', dest='preserve_order', action='store_false',
+                        help="with --jobs, write work units as they finish instead of in folder order")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"with --jobs, split folders into units of this many messages (default: {DEFAULT_CHUNK_SIZE})")
+    add_export_arguments(parser)
+    parser.add_argument('--index', metavar='PATH',
+                        help="index made by 'ost_export.py scan', used to balance --jobs and for --progress")
+    parser.add_argument('--progress', action='store_true',
+                        help="show a progress line with the ETA on stderr")
+    parser.add_argument('--metrics-json', metavar='PATH',
+                        help="write time and byte counts for each export stage to PATH as JSON")
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    options = export_options_from_args(parser, args)
+    if args.dedup_attachments:
+        options.attachment_store = os.path.abspath(os.path.join(args.output_dir, ATTACHMENT_STORE_DIRNAME))
+    try:
+        export_ost(args.ost_path, args.output_dir, args.format, jobs=args.jobs,
+                   preserve_order=args.preserve_order, chunk_size=args.chunk_size,
+                   options=options, progress=args.progress, metrics_path=args.metrics_json,
+                   index_path=args.index)
+    except OstExportError:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
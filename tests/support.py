@@ -0,0 +1,115 @@
+"""Setup and helpers shared by the tests.
+
+Run the tests with ``python -m unittest discover tests`` from the repository
+root. Importing this module installs the synthetic pypff stand-in of the
+benchmarks, so ``ost_export`` is imported from here by every test module.
+"""
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, os.pardir, 'benchmarks'))
+sys.path.insert(0, os.path.join(TESTS_DIR, os.pardir))
+
+import fake_pypff
+fake_pypff.install()
+import ost_export
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+
+class FailingAttachment:
+    """Attachment whose data can no longer be read after the first chunk."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._reads = 0
+
+    def seek_offset(self, offset: int, whence: int = 0):
+        pass
+
+    def read_buffer(self, size: int) -> bytes:
+        self._reads += 1
+        if self._reads > 1:
+            raise IOError("read error")
+        return b'x' * size
+
+
+class LargeAttachment(FailingAttachment):
+    """Attachment that can be read in full."""
+
+    def read_buffer(self, size: int) -> bytes:
+        return b'x' * size
+
+
+class StubMessage:
+    """Message with the attributes of the pypff properties, for hand made folders."""
+
+    def __init__(self, identifier: int, subject: str, body: str = 'Body', sender: str = 'alice@example.com',
+                 delivery_time: datetime.datetime = datetime.datetime(2024, 5, 1, 12, 0),
+                 attachments=()):
+        self.identifier = identifier
+        self.subject = subject
+        self.sender_name = sender
+        self.display_to = 'bob@example.com'
+        self.display_cc = ''
+        self.delivery_time = delivery_time
+        self.plain_text_body = body.encode('utf-8')
+        self.html_body = None
+        self.attachments = list(attachments)
+
+    @property
+    def number_of_attachments(self):
+        return len(self.attachments)
+
+
+class StubFolder:
+    """Folder holding a list of messages and subfolders."""
+
+    def __init__(self, name: str, messages=(), sub_folders=()):
+        self.name = name
+        self.sub_messages = list(messages)
+        self.sub_folders = list(sub_folders)
+
+
+def make_message(subject: str, attachment=None):
+    msg = MIMEMultipart('mixed')
+    msg['Subject'] = subject
+    msg['From'] = 'sender@example.com'
+    msg.attach(MIMEText(f"Body of {subject}\n", 'plain', 'utf-8'))
+    if attachment is not None:
+        msg.attach(ost_export.StreamedAttachment('application', 'octet-stream', attachment,
+                                                 attachment.size, chunk_size=57 * 100))
+    return msg
+
+
+def read_at(path: str, offset: int, length: int) -> bytes:
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def count_from_lines(path: str) -> int:
+    """Return the number of messages of an MBOX file."""
+    with open(path, 'rb') as f:
+        return sum(1 for line in f if line.startswith(b'From '))
+
+
+class OutputDirTestCase(unittest.TestCase):
+    """Test case with a temporary directory, removed afterwards."""
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='ost_export_test-')
+        self.addCleanup(shutil.rmtree, self.output_dir, ignore_errors=True)
+
+    def write_shape(self, shape: dict, name: str = 'shape.json') -> str:
+        """Write a fake_pypff shape file and return its path, to be exported as an OST file."""
+        path = os.path.join(self.output_dir, name)
+        with open(path, 'w') as f:
+            json.dump(shape, f)
+        return path
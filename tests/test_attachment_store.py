@@ -0,0 +1,107 @@
+"""Tests for the content-addressed attachment store."""
+import email
+import email.policy
+import hashlib
+import os
+import unittest
+
+from support import OutputDirTestCase, StubFolder, StubMessage, ost_export
+
+
+class DataAttachment:
+    """Attachment holding the given data, counting the bytes read."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.size = len(data)
+        self.read = 0
+        self._offset = 0
+
+    def seek_offset(self, offset: int, whence: int = 0):
+        self._offset = offset
+
+    def read_buffer(self, size: int) -> bytes:
+        chunk = self.data[self._offset:self._offset + size]
+        self._offset += len(chunk)
+        self.read += len(chunk)
+        return chunk
+
+
+def blob_files(store_path: str) -> list:
+    return sorted(name for directory, _, names in os.walk(store_path) for name in names)
+
+
+class AttachmentStoreTest(OutputDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = ost_export.AttachmentStore(os.path.join(self.output_dir, 'attachments'), chunk_size=100)
+
+    def test_identical_data_stored_once(self):
+        data = os.urandom(1000)
+        digest = hashlib.sha256(data).hexdigest()
+        first, second = DataAttachment(data), DataAttachment(data)
+
+        self.assertEqual(self.store.add(first, first.size), digest)
+        self.assertEqual(self.store.add(second, second.size), digest)
+        self.assertEqual(self.store.add(None, len(data), data), digest)
+
+        self.assertEqual(blob_files(self.store.path), [digest])
+        with open(self.store.blob_path(digest), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        # A known size is hashed before the data is written, a duplicate is only read once
+        self.assertEqual((first.read, second.read), (1000, 1000))
+
+    def test_same_size_different_data(self):
+        data = [os.urandom(1000), os.urandom(1000)]
+        digests = [self.store.add(DataAttachment(d), len(d)) for d in data]
+        self.assertEqual(blob_files(self.store.path), sorted(digests))
+        for digest, d in zip(digests, data):
+            with open(self.store.blob_path(digest), 'rb') as f:
+                self.assertEqual(f.read(), d)
+
+    def test_external_body_part(self):
+        data = b'%PDF-1.4 report'
+        digest = self.store.add(None, len(data), data)
+        part = self.store.external_body_part(digest, len(data), 'application/pdf', 'report.pdf')
+
+        parsed = email.message_from_bytes(part.as_bytes(), policy=email.policy.default)
+        self.assertEqual(parsed.get_content_type(), 'message/external-body')
+        self.assertEqual(parsed.get_param('access-type'), 'local-file')
+        self.assertEqual(parsed.get_param('name'), f"attachments/{digest[:2]}/{digest}")
+        self.assertEqual(parsed.get_param('size'), str(len(data)))
+        self.assertEqual(parsed.get_filename(), 'report.pdf')
+        inner = parsed.get_payload()[0]
+        self.assertEqual(inner.get_content_type(), 'application/pdf')
+        self.assertEqual(inner['Content-ID'], f"<{digest}@sha256>")
+
+
+class ExportWithStoreTest(OutputDirTestCase):
+
+    def test_messages_refer_to_one_blob(self):
+        data = os.urandom(5000)
+        messages = [StubMessage(i, f"Report {i}", attachments=[DataAttachment(data)]) for i in range(3)]
+        options = ost_export.ExportOptions(
+            attachment_store=os.path.join(self.output_dir, ost_export.ATTACHMENT_STORE_DIRNAME),
+            attachment_buffer_size=1024)
+        ost_export.process_folder(StubFolder('Inbox', messages), self.output_dir, 'eml', options)
+
+        digest = hashlib.sha256(data).hexdigest()
+        self.assertEqual(blob_files(options.attachment_store), [digest])
+        folder_dir = os.path.join(self.output_dir, 'Inbox')
+        eml_files = sorted(os.listdir(folder_dir))
+        self.assertEqual(len(eml_files), 3)
+        for name in eml_files:
+            with open(os.path.join(folder_dir, name), 'rb') as f:
+                msg = email.message_from_binary_file(f, policy=email.policy.default)
+            parts = [part for part in msg.walk() if part.get_content_type() == 'message/external-body']
+            self.assertEqual(len(parts), 1)
+            # References are relative to the export directory
+            reference = parts[0].get_param('name')
+            self.assertEqual(os.path.join(self.output_dir, *reference.split('/')),
+                             os.path.join(options.attachment_store, digest[:2], digest))
+            self.assertEqual(parts[0].get_param('size'), str(len(data)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Tests for the batch export of many OST files."""
+import multiprocessing
+import os
+import time
+import unittest
+
+from support import OutputDirTestCase, count_from_lines, ost_export
+
+export_ost = ost_export.export_ost
+create_message = ost_export.create_message
+
+MESSAGES = 30
+
+
+def slow_create_message(*args, **kwargs):
+    time.sleep(0.02)
+    return create_message(*args, **kwargs)
+
+
+def crashing_export_ost(ost_path, output_dir, format='mbox', *args, **kwargs):
+    """Export slowly, except that the worker exporting a 'crash' file dies.
+
+    It dies once the other files have written part of their messages, or at
+    the latest after two seconds.
+    """
+    if 'crash' in os.path.basename(ost_path):
+        batch_dir = os.path.dirname(output_dir)
+        others = [os.path.join(batch_dir, name, 'Folder_0.mbox') for name in ('first', 'last')]
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline and not all(
+                os.path.exists(path) and count_from_lines(path) for path in others):
+            time.sleep(0.01)
+        os._exit(1)
+    ost_export.create_message = slow_create_message
+    return export_ost(ost_path, output_dir, format, *args, **kwargs)
+
+
+@unittest.skipUnless(multiprocessing.get_start_method() == 'fork',
+                     "the crashing export is inherited by forked workers only")
+class BrokenWorkerTest(OutputDirTestCase):
+
+    SHAPE = {'depth': 1, 'fanout': 1, 'messages': [MESSAGES, MESSAGES], 'attachments': [0, 0],
+             'html_ratio': 0}
+
+    def setUp(self):
+        super().setUp()
+        self.ost_paths = [self.write_shape(self.SHAPE, f"{name}.json") for name in ('first', 'crash', 'last')]
+        self.batch_dir = os.path.join(self.output_dir, 'export')
+        ost_export.export_ost = crashing_export_ost
+        self.addCleanup(setattr, ost_export, 'export_ost', export_ost)
+
+    def export(self, checkpoint: bool = False):
+        # Small buffers, so the interrupted exports leave messages on disk
+        options = ost_export.ExportOptions(mbox_buffer_size=1024, checkpoint=checkpoint)
+        report = ost_export.export_batch(self.ost_paths, self.batch_dir, jobs=3, options=options)
+
+        statuses = {os.path.basename(entry['ost_path']): entry['status'] for entry in report['results']}
+        self.assertEqual(statuses, {'first.json': 'ok', 'crash.json': 'failed', 'last.json': 'ok'})
+        self.assertEqual(report['messages'], 2 * MESSAGES)
+        for name in ('first', 'last'):
+            self.assertEqual(count_from_lines(os.path.join(self.batch_dir, name, 'Folder_0.mbox')), MESSAGES)
+
+    def test_only_the_crashing_file_fails(self):
+        self.export()
+
+    def test_retry_resumes_from_checkpoint(self):
+        self.export(checkpoint=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
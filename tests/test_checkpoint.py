@@ -0,0 +1,129 @@
+"""Tests for the checkpoint store and the resumed exports."""
+import os
+import subprocess
+import sys
+import unittest
+
+from support import TESTS_DIR, OutputDirTestCase, count_from_lines, make_message, ost_export
+
+# Exports in a child process that dies at a chosen point, as if killed
+KILLED_EXPORT = """
+import os, sys
+sys.path.insert(0, {tests_dir!r})
+from support import ost_export
+
+def die(*args, **kwargs):
+    os._exit(1)
+
+{patch}
+options = ost_export.ExportOptions(checkpoint=True, mbox_buffer_size=64 * 1024)
+ost_export.export_ost({shape_path!r}, {export_dir!r}, 'mbox', jobs={jobs}, chunk_size=200, options=options)
+"""
+
+# The export dies while building the 151st message, before the first commit
+DIE_AT_MESSAGE = """
+create_message = ost_export.create_message
+calls = []
+
+def create_message_or_die(*args, **kwargs):
+    calls.append(1)
+    if len(calls) > 150:
+        die()
+    return create_message(*args, **kwargs)
+
+ost_export.create_message = create_message_or_die
+"""
+
+# The parent dies after appending the first merged unit, before releasing it
+DIE_AT_RELEASE = """
+ost_export.CheckpointStore.release_unit = die
+"""
+
+
+class SharedDatabaseTest(OutputDirTestCase):
+    """Stores of parallel workers share one database without waiting on each other."""
+
+    def open_stores(self, cls):
+        stores = [cls(self.output_dir), cls(self.output_dir)]
+        for store in stores:
+            # Fail at once instead of after the default timeout
+            store._conn.execute('PRAGMA busy_timeout = 100')
+            self.addCleanup(store.close)
+        return stores
+
+    def test_checkpoint_records(self):
+        first, second = self.open_stores(ost_export.CheckpointStore)
+        first.record('Inbox', ('1', ''), 'Inbox.mbox', 0, 10, unit='a')
+        second.record('Inbox', ('2', ''), 'Inbox.mbox', 0, 10, unit='b')
+        second.commit()
+        first.commit()
+        rows = first._conn.execute('SELECT message_id FROM exported ORDER BY message_id').fetchall()
+        self.assertEqual(rows, [('1',), ('2',)])
+
+    def test_fingerprints(self):
+        first, second = self.open_stores(ost_export.CheckpointStore)
+        duplicates = first.duplicate_index()
+        duplicates.add(b'f' * 16, 'Inbox', 'Inbox.mbox', unit='a')
+        self.assertEqual(duplicates.get(b'f' * 16), ('Inbox', 'Inbox.mbox', None))
+        second.record('Inbox', ('2', ''), 'Inbox.mbox', 0, 10, unit='b')
+        second.commit()
+        first.commit()
+        self.assertEqual(second.duplicate_index().get(b'f' * 16), ('Inbox', 'Inbox.mbox', None))
+
+    @unittest.skipUnless(ost_export.fts5_available(), "SQLite has no FTS5")
+    def test_search_index(self):
+        first, second = self.open_stores(ost_export.SearchIndex)
+        first.add('Inbox', ('1', ''), make_message('first'), 'Inbox.mbox', unit='a')
+        second.add('Inbox', ('2', ''), make_message('second'), 'Inbox.mbox', unit='b')
+        second.commit()
+        first.commit()
+        first.release_unit('a')
+        second.release_unit('b')
+        self.assertEqual(sorted(result['subject'] for result in first.search('first OR second')),
+                         ['first', 'second'])
+
+
+
+class ResumeTest(OutputDirTestCase):
+    """Exports killed before their first commit are resumed without copies."""
+
+    SHAPE = {'depth': 1, 'fanout': 1, 'messages': [600, 600], 'attachments': [0, 0],
+             'html_ratio': 0, 'plain_size': [1000, 2000]}
+
+    def setUp(self):
+        super().setUp()
+        self.shape_path = self.write_shape(self.SHAPE)
+        self.export_dir = os.path.join(self.output_dir, 'export')
+        self.mbox_path = os.path.join(self.export_dir, 'Folder_0.mbox')
+
+    def kill_and_resume(self, patch: str, jobs: int = 1):
+        script = KILLED_EXPORT.format(tests_dir=TESTS_DIR, patch=patch, shape_path=self.shape_path,
+                                      export_dir=self.export_dir, jobs=jobs)
+        result = subprocess.run([sys.executable, '-c', script], stderr=subprocess.DEVNULL)
+        self.assertEqual(result.returncode, 1)
+        self.assertGreater(count_from_lines(self.mbox_path), 0)
+
+        options = ost_export.ExportOptions(checkpoint=True)
+        ost_export.export_ost(self.shape_path, self.export_dir, 'mbox', jobs=jobs, chunk_size=200, options=options)
+        self.assertEqual(count_from_lines(self.mbox_path), 600)
+
+    def test_store_drops_data_of_started_file(self):
+        store = ost_export.CheckpointStore(self.output_dir)
+        store.start_file('Inbox.mbox', 5)
+        store.close()
+        with open(os.path.join(self.output_dir, 'Inbox.mbox'), 'wb') as f:
+            f.write(b'From a\nFrom b\n')
+        store = ost_export.CheckpointStore(self.output_dir)
+        store.recover()
+        store.close()
+        self.assertEqual(os.path.getsize(os.path.join(self.output_dir, 'Inbox.mbox')), 5)
+
+    def test_serial_export_killed_before_first_commit(self):
+        self.kill_and_resume(DIE_AT_MESSAGE)
+
+    def test_parallel_export_killed_before_release(self):
+        self.kill_and_resume(DIE_AT_RELEASE, jobs=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
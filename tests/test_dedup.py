@@ -0,0 +1,120 @@
+"""Tests for the messages found in several folders (--dedup-messages)."""
+import datetime
+import email
+import os
+import unittest
+
+from support import FailingAttachment, OutputDirTestCase, StubFolder, StubMessage, count_from_lines, ost_export
+
+
+def read_body(path: str) -> str:
+    """Return the plain text body of an EML file."""
+    with open(path, 'rb') as f:
+        msg = email.message_from_binary_file(f)
+    for part in msg.walk():
+        if part.get_content_type() == 'text/plain':
+            return part.get_payload(decode=True).decode('utf-8')
+    return ''
+
+
+def folders_with_copies():
+    """Return folders A, B and C, where B and C hold a copy of the first message of A."""
+    return [StubFolder('A', [StubMessage(1, 'Status', body='status body'), StubMessage(2, 'Lunch')]),
+            StubFolder('B', [StubMessage(3, 'Status', body='status body'), StubMessage(4, 'Plans')]),
+            StubFolder('C', [StubMessage(5, 'Status', body='status body')])]
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_copies_share_a_fingerprint(self):
+        message = StubMessage(1, 'Status', attachments=[FailingAttachment(100)])
+        copy = StubMessage(2, 'Status', attachments=[FailingAttachment(100)])
+        # Attachment data is never read
+        self.assertEqual(ost_export.message_fingerprint(message), ost_export.message_fingerprint(copy))
+        self.assertEqual(len(ost_export.message_fingerprint(message)), 16)
+
+    def test_differences(self):
+        fingerprint = ost_export.message_fingerprint(StubMessage(1, 'Status', attachments=[FailingAttachment(100)]))
+        others = [StubMessage(1, 'Status!', attachments=[FailingAttachment(100)]),
+                  StubMessage(1, 'Status', body='Other', attachments=[FailingAttachment(100)]),
+                  StubMessage(1, 'Status', sender='carol@example.com', attachments=[FailingAttachment(100)]),
+                  StubMessage(1, 'Status', delivery_time=datetime.datetime(2024, 5, 1, 12, 1),
+                              attachments=[FailingAttachment(100)]),
+                  StubMessage(1, 'Status', attachments=[FailingAttachment(101)]),
+                  StubMessage(1, 'Status')]
+        for other in others:
+            self.assertNotEqual(ost_export.message_fingerprint(other), fingerprint)
+
+
+class DedupMessagesTest(OutputDirTestCase):
+
+    def export(self, root_folders, format: str = 'eml', mode: str = 'link'):
+        options = ost_export.ExportOptions(dedup_messages=mode, html_to_text='none')
+        duplicates = ost_export.DuplicateIndex(self.output_dir)
+        ost_export.METRICS.reset()
+        for folder in root_folders:
+            ost_export.process_folder(folder, self.output_dir, format, options, duplicates=duplicates)
+
+    def test_linked_copy_not_overwritten(self):
+        original = StubMessage(1, 'RE status', body='original body')
+        copy = StubMessage(2, 'RE status', body='original body')
+        other = StubMessage(3, 'RE status', body='other body',
+                            delivery_time=datetime.datetime(2024, 6, 1, 9, 0))
+        self.export([StubFolder('A', [original]), StubFolder('B', [copy, other])])
+
+        path_a = os.path.join(self.output_dir, 'A', 'RE_status.eml')
+        path_b = os.path.join(self.output_dir, 'B', 'RE_status.eml')
+        self.assertEqual(read_body(path_a), 'original body')
+        self.assertEqual(read_body(path_b), 'other body')
+        self.assertNotEqual(os.stat(path_a).st_ino, os.stat(path_b).st_ino)
+        self.assertEqual(ost_export.METRICS.counters['duplicates'], 1)
+
+    def assert_counts(self, messages: int, duplicates: int):
+        self.assertEqual(ost_export.METRICS.counters['messages'], messages)
+        self.assertEqual(ost_export.METRICS.counters['duplicates'], duplicates)
+
+    def test_skip_eml(self):
+        self.export(folders_with_copies(), mode='skip')
+        self.assert_counts(3, 2)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.output_dir, 'A'))), ['Lunch.eml', 'Status.eml'])
+        self.assertEqual(os.listdir(os.path.join(self.output_dir, 'B')), ['Plans.eml'])
+        self.assertEqual(os.listdir(os.path.join(self.output_dir, 'C')), [])
+
+    def test_link_eml(self):
+        self.export(folders_with_copies(), mode='link')
+        self.assert_counts(3, 2)
+        paths = [os.path.join(self.output_dir, name, 'Status.eml') for name in 'ABC']
+        self.assertEqual(len({os.stat(path).st_ino for path in paths}), 1)
+        self.assertEqual(os.stat(paths[0]).st_nlink, 3)
+        self.assertEqual(read_body(paths[2]), 'status body')
+
+    def test_link_maildir(self):
+        self.export(folders_with_copies(), format='maildir', mode='link')
+        self.assert_counts(3, 2)
+        files = {name: sorted(os.listdir(os.path.join(self.output_dir, f".{name}", 'new'))) for name in 'ABC'}
+        self.assertEqual([len(names) for names in files.values()], [2, 2, 1])
+        copy = os.path.join(self.output_dir, '.C', 'new', files['C'][0])
+        self.assertEqual(os.stat(copy).st_nlink, 3)
+        self.assertEqual(read_body(copy), 'status body')
+
+    def test_skip_mbox(self):
+        self.export(folders_with_copies(), format='mbox', mode='skip')
+        self.assert_counts(3, 2)
+        counts = [count_from_lines(os.path.join(self.output_dir, f"{name}.mbox")) for name in 'AB']
+        self.assertEqual(counts, [2, 1])
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'C.mbox')))
+
+    def test_link_mbox(self):
+        self.export(folders_with_copies(), format='mbox', mode='link')
+        self.assert_counts(3, 2)
+        for name in 'BC':
+            with open(os.path.join(self.output_dir, f"{name}.mbox"), 'rb') as f:
+                messages = [email.message_from_bytes(data) for data in f.read().split(b'\nFrom ')]
+            references = [msg for msg in messages if msg['X-Duplicate-Of']]
+            self.assertEqual(len(references), 1)
+            self.assertEqual(references[0]['X-Duplicate-Of'], 'A')
+            self.assertEqual(references[0]['Subject'], 'Status')
+
+
+if __name__ == '__main__':
+    unittest.main()
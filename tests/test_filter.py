@@ -0,0 +1,111 @@
+"""Tests for the folder and message filters."""
+import argparse
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from support import LargeAttachment, StubFolder, StubMessage, ost_export
+
+MessageFilter = ost_export.MessageFilter
+
+
+def message_at(delivery_time):
+    return StubMessage(1, 'Subject', delivery_time=delivery_time)
+
+
+class DateRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = MessageFilter(since=ost_export.parse_date('2024-05-01'),
+                                    before=ost_export.parse_end_date('2024-05-31'))
+
+    def test_naive_times(self):
+        self.assertFalse(self.filter.message_selected(message_at(datetime(2024, 4, 30, 23, 59))))
+        self.assertTrue(self.filter.message_selected(message_at(datetime(2024, 5, 1, 0, 0))))
+        self.assertTrue(self.filter.message_selected(message_at(datetime(2024, 5, 31, 23, 59))))
+        self.assertFalse(self.filter.message_selected(message_at(datetime(2024, 6, 1, 0, 0))))
+
+    def test_aware_times_compared_in_utc(self):
+        east = timezone(timedelta(hours=2))
+        west = timezone(timedelta(hours=-1))
+        # 2024-05-31 23:30 UTC
+        self.assertTrue(self.filter.message_selected(message_at(datetime(2024, 6, 1, 1, 30, tzinfo=east))))
+        # 2024-06-01 00:30 UTC
+        self.assertFalse(self.filter.message_selected(message_at(datetime(2024, 5, 31, 23, 30, tzinfo=west))))
+        # 2024-04-30 23:00 UTC
+        self.assertFalse(self.filter.message_selected(message_at(datetime(2024, 5, 1, 1, 0, tzinfo=east))))
+
+    def test_until_date_includes_the_whole_day(self):
+        self.assertEqual(ost_export.parse_end_date('2024-05-31'), datetime(2024, 6, 1))
+        self.assertEqual(ost_export.parse_end_date('2024-05-31T12:00'), datetime(2024, 5, 31, 12, 0))
+
+    def test_message_without_delivery_time(self):
+        self.assertFalse(self.filter.message_selected(message_at(None)))
+        self.assertTrue(MessageFilter().message_selected(message_at(None)))
+
+
+class FolderPatternTest(unittest.TestCase):
+
+    def test_exclude_skips_subfolders(self):
+        message_filter = MessageFilter(exclude_folders=['Top/Archive'])
+        self.assertTrue(message_filter.folder_excluded('Top/Archive'))
+        self.assertTrue(message_filter.folder_excluded('top/archive/2019'))
+        self.assertFalse(message_filter.folder_excluded('Top/Archives'))
+        self.assertFalse(message_filter.folder_excluded('Top'))
+
+    def test_star_matches_slashes(self):
+        message_filter = MessageFilter(include_folders=['*/Inbox'])
+        self.assertTrue(message_filter.folder_selected('Top/Inbox'))
+        self.assertTrue(message_filter.folder_selected('Top/Mailbox/INBOX'))
+        self.assertFalse(message_filter.folder_selected('Top/Inbox/Projects'))
+        self.assertFalse(message_filter.folder_excluded('Top/Inbox/Projects'))
+
+    def test_exclude_wins_over_include(self):
+        message_filter = MessageFilter(include_folders=['*Inbox*'], exclude_folders=['Top/Inbox'])
+        self.assertFalse(message_filter.folder_selected('Top/Inbox'))
+        self.assertFalse(message_filter.folder_selected('Top/Inbox/Projects'))
+        self.assertTrue(message_filter.folder_selected('Other/Inbox'))
+
+    def test_folder_tree(self):
+        messages = [StubMessage(1, 'Subject')]
+        root = StubFolder('Top', messages, [
+            StubFolder('Inbox', messages * 2, [StubFolder('Projects', messages * 3)]),
+            StubFolder('Archive', messages * 4, [StubFolder('Inbox', messages * 5)]),
+        ])
+        message_filter = MessageFilter(include_folders=['*/Inbox', '*/Projects'],
+                                       exclude_folders=['Top/Archive'])
+
+        paths = [(path, index_path) for _, path, index_path
+                 in ost_export.walk_folders([root], message_filter, subfolders_first=True)]
+        self.assertEqual(paths, [('Top/Inbox/Projects', (0, 0, 0)), ('Top/Inbox', (0, 0)), ('Top', (0,))])
+        self.assertEqual(ost_export.count_tree_messages([root], message_filter), 2 + 3)
+        units = ost_export.plan_work_units([root], message_filter=message_filter)
+        self.assertEqual([unit[1] for unit in units], ['Top/Inbox/Projects', 'Top/Inbox'])
+
+
+class MessagePropertyTest(unittest.TestCase):
+
+    def test_sender_and_subject(self):
+        message_filter = MessageFilter(sender='@example\\.com$', subject='^re: report')
+        self.assertTrue(message_filter.message_selected(StubMessage(1, 'RE: Report for May')))
+        self.assertFalse(message_filter.message_selected(StubMessage(1, 'Fwd: RE: Report')))
+        self.assertFalse(message_filter.message_selected(
+            StubMessage(1, 'RE: Report', sender='alice@example.org')))
+
+    def test_attachment_size(self):
+        message_filter = MessageFilter(max_attachment_size=1000)
+        self.assertTrue(message_filter.message_selected(StubMessage(1, 'Small', attachments=[LargeAttachment(1000)])))
+        self.assertFalse(message_filter.message_selected(
+            StubMessage(1, 'Large', attachments=[LargeAttachment(10), LargeAttachment(1001)])))
+        self.assertTrue(message_filter.message_selected(StubMessage(1, 'None')))
+
+    def test_attachment_size_option(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('format')
+        ost_export.add_export_arguments(parser)
+        args = parser.parse_args(['mbox', '--max-attachment-size', '10M'])
+        options = ost_export.export_options_from_args(parser, args)
+        self.assertEqual(options.message_filter.max_attachment_size, 10 * 1024 ** 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+"""Tests for the plain text alternative of HTML messages."""
+import unittest
+
+from support import ost_export
+
+SAMPLES = [
+    '<p>a</p>\n\n<p>b</p>',
+    '<p>a</p> <p>b</p>',
+    '<pre>\n\n</pre><textarea> </textarea>',
+    'text&amp',
+    'a &amp; b &lt; &copy x &ampx &notit; &#65 &#x42;',
+    '<html><head><style>p {}</style></head><body><p>Hello &amp; <b>bold</b></p>'
+    '<script>var a = "<p>";</script><!-- c --><div>x&nbsp;y</div><br/>tail</body></html>',
+]
+
+
+class HtmlToTextFastTest(unittest.TestCase):
+
+    def test_whitespace_nodes(self):
+        self.assertEqual(ost_export.html_to_text_fast('<p>a</p>\n\n<p>b</p>'), 'a\n\n\nb')
+        self.assertEqual(ost_export.html_to_text_fast('<pre>\n\n</pre>'), '\n\n')
+
+    def test_character_references(self):
+        self.assertEqual(ost_export.html_to_text_fast('text&amp'), 'text&amp')
+        self.assertEqual(ost_export.html_to_text_fast('&amp; &ampx &notit; &#65;'), '& &ampx &notit A')
+
+    @unittest.skipIf(ost_export.BeautifulSoup is None, "bs4 is not installed")
+    def test_same_as_bs4(self):
+        for html in SAMPLES:
+            with self.subTest(html=html):
+                self.assertEqual(ost_export.html_to_text_fast(html), ost_export.html_to_text_bs4(html))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""Tests for the Maildir output."""
+import os
+import threading
+import time
+import unittest
+
+from support import LargeAttachment, OutputDirTestCase, make_message, ost_export
+
+
+class SlowAttachment(LargeAttachment):
+    """Attachment read slowly, so that deliveries overlap."""
+
+    def read_buffer(self, size: int) -> bytes:
+        time.sleep(0.01)
+        return super().read_buffer(size)
+
+
+class MaildirFolderNameTest(unittest.TestCase):
+
+    def test_ascii_names(self):
+        self.assertEqual(ost_export.maildir_folder_name('Inbox/Projects'), '.Inbox.Projects')
+        self.assertEqual(ost_export.maildir_folder_name('Inbox/v1.2'), '.Inbox.v1_2')
+
+    def test_modified_utf7(self):
+        # Example from RFC 3501 section 5.1.3
+        self.assertEqual(ost_export.maildir_folder_name('~peter/mail/台北/日本語'),
+                         '.~peter.mail.&U,BTFw-.&ZeVnLIqe-')
+        self.assertEqual(ost_export.maildir_folder_name('Entwürfe'), '.Entw&APw-rfe')
+        self.assertEqual(ost_export.maildir_folder_name('R&D'), '.R&-D')
+
+
+
+class MaildirWriterTest(OutputDirTestCase):
+
+    def test_concurrent_deliveries_of_one_message(self):
+        path = os.path.join(self.output_dir, '.Inbox')
+        writers = [ost_export.MaildirWriter(path), ost_export.MaildirWriter(path)]
+        name = ost_export.MaildirWriter.filename('Inbox\0' + '1')
+        errors = []
+
+        def deliver(writer):
+            try:
+                writer.write(make_message('same', SlowAttachment(57 * 400)), name)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=deliver, args=(writer,)) for writer in writers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(os.path.join(path, 'tmp')), [])
+        with open(os.path.join(path, 'new', name), 'rb') as f:
+            data = f.read()
+        with open(os.path.join(self.output_dir, 'single.eml'), 'wb') as f:
+            expected_size = ost_export.write_message(make_message('same', SlowAttachment(57 * 400)), f)
+        self.assertEqual(len(data), expected_size)
+        self.assertEqual(data.count(b'Subject: same'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""Regression tests for the message offsets recorded for MBOX files."""
+import os
+import sqlite3
+import unittest
+
+from support import FailingAttachment, OutputDirTestCase, fake_pypff, make_message, ost_export, read_at
+
+
+class MboxWriterOffsetTest(OutputDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.output_dir, 'Inbox.mbox')
+
+    def test_write_after_failed_write(self):
+        with ost_export.MboxWriter(self.path) as writer:
+            first = writer.write(make_message('first'))
+            failed = writer.write(make_message('failed', FailingAttachment(57 * 1000)))
+            third = writer.write(make_message('third'))
+
+        self.assertIsNone(failed)
+        self.assertEqual(first[0], 0)
+        self.assertEqual(third[0], first[0] + first[1])
+        self.assertEqual(os.path.getsize(self.path), third[0] + third[1])
+        self.assertTrue(read_at(self.path, *third).startswith(b'From '))
+        self.assertIn(b'Subject: third', read_at(self.path, *third))
+
+    def test_offsets_after_failed_write_in_appended_file(self):
+        with ost_export.MboxWriter(self.path) as writer:
+            writer.write(make_message('earlier run'))
+        with ost_export.MboxWriter(self.path) as writer:
+            writer.write(make_message('failed', FailingAttachment(57 * 1000)))
+            location = writer.write(make_message('after'))
+
+        self.assertEqual(os.path.getsize(self.path), location[0] + location[1])
+        self.assertIn(b'Subject: after', read_at(self.path, *location))
+
+
+class ExportOffsetTest(OutputDirTestCase):
+    """Offsets recorded by a whole export, with some messages failing to write."""
+
+    SHAPE = {'depth': 1, 'fanout': 2, 'messages': [40, 40], 'attachments': [1, 2],
+             'attachment_size': [20000, 60000]}
+
+    def setUp(self):
+        super().setUp()
+        self.shape_path = self.write_shape(self.SHAPE)
+        self.export_dir = os.path.join(self.output_dir, 'export')
+
+        # Every seventh attachment fails after its first chunk, so the
+        # message is dropped while it is being written
+        read_buffer = fake_pypff.attachment.read_buffer
+
+        def failing_read_buffer(attachment, size):
+            if attachment.identifier % 7 == 0 and attachment._offset > 0:
+                raise IOError("read error")
+            return read_buffer(attachment, size)
+
+        fake_pypff.attachment.read_buffer = failing_read_buffer
+        self.addCleanup(setattr, fake_pypff.attachment, 'read_buffer', read_buffer)
+
+    def assert_offsets_on_from_lines(self, rows):
+        self.assertTrue(rows)
+        for output_path, offset, length in rows:
+            path = os.path.join(self.export_dir, output_path)
+            data = read_at(path, offset, length)
+            self.assertTrue(data.startswith(b'From '), f"{output_path} @{offset}")
+            self.assertLessEqual(offset + length, os.path.getsize(path))
+
+    def export(self, jobs: int = 1):
+        options = ost_export.ExportOptions(checkpoint=True, search_index=True, attachment_buffer_size=16384)
+        ost_export.export_ost(self.shape_path, self.export_dir, 'mbox', jobs=jobs, options=options)
+        self.assertGreater(ost_export.METRICS.counters['errors'], 0)
+
+    def check_export(self):
+        with sqlite3.connect(os.path.join(self.export_dir, ost_export.CHECKPOINT_FILENAME)) as connection:
+            self.assert_offsets_on_from_lines(
+                connection.execute('SELECT output_path, offset, length FROM exported').fetchall())
+        with sqlite3.connect(os.path.join(self.export_dir, ost_export.SEARCH_INDEX_FILENAME)) as connection:
+            self.assert_offsets_on_from_lines(
+                connection.execute('SELECT output_path, offset, length FROM locations').fetchall())
+
+    def test_serial_export(self):
+        self.export()
+        self.check_export()
+
+    def test_parallel_export(self):
+        self.export(jobs=2)
+        self.check_export()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""Tests for the per-stage metrics of an export."""
+import json
+import os
+import unittest
+
+from support import OutputDirTestCase, ost_export
+
+
+class BytesWrittenTest(OutputDirTestCase):
+
+    SHAPE = {'depth': 2, 'fanout': 2, 'messages': [10, 10], 'attachments': [0, 2],
+             'attachment_size': [1000, 5000], 'html_ratio': 0.5}
+
+    def export(self, format: str, **options) -> dict:
+        ost_path = self.write_shape(self.SHAPE)
+        metrics_path = os.path.join(self.output_dir, 'metrics.json')
+        self.export_dir = os.path.join(self.output_dir, 'export')
+        ost_export.export_ost(ost_path, self.export_dir, format, options=ost_export.ExportOptions(**options),
+                              metrics_path=metrics_path)
+        with open(metrics_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def output_size(self) -> int:
+        return sum(os.path.getsize(os.path.join(directory, name))
+                   for directory, _, names in os.walk(self.export_dir) for name in names)
+
+    def assert_bytes_written(self, format: str, **options):
+        summary = self.export(format, **options)
+        self.assertEqual(summary['bytes_written'], self.output_size())
+        self.assertEqual(summary['stages']['disk_write']['bytes'], summary['bytes_written'])
+        return summary
+
+    def test_mbox(self):
+        self.assert_bytes_written('mbox')
+
+    def test_gzip_mbox(self):
+        summary = self.assert_bytes_written('mbox', compression='gzip')
+        # The compressor is given the uncompressed messages
+        self.assertGreater(summary['stages']['compress']['bytes'], summary['bytes_written'])
+
+    def test_eml(self):
+        self.assert_bytes_written('eml')
+
+    def test_zip_eml(self):
+        summary = self.assert_bytes_written('eml', compression='zip')
+        self.assertGreater(summary['stages']['compress']['bytes'], 0)
+
+    def test_maildir(self):
+        self.assert_bytes_written('maildir')
+
+
+if __name__ == '__main__':
+    unittest.main()
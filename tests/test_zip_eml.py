@@ -0,0 +1,40 @@
+"""Tests for the EML files written into zip archives."""
+import os
+import unittest
+import zipfile
+
+from support import FailingAttachment, LargeAttachment, OutputDirTestCase, make_message, ost_export
+
+
+class ZipEmlWriterTest(OutputDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.output_dir, 'Inbox.zip')
+
+    def test_failed_message_leaves_no_entry(self):
+        with ost_export.ZipEmlWriter(self.path, spool_size=4096) as writer:
+            writer.write('first.eml', make_message('first'))
+            with self.assertRaises(IOError):
+                writer.write('failed.eml', make_message('failed', FailingAttachment(57 * 1000)))
+            # The name of the failed message is still free
+            self.assertEqual(writer.write('failed.eml', make_message('retried')), 'failed.eml')
+
+        with zipfile.ZipFile(self.path) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['first.eml', 'failed.eml'])
+            self.assertIn(b'Subject: retried', archive.read('failed.eml'))
+
+    def test_large_message_spooled_to_disk(self):
+        attachment = LargeAttachment(57 * 1000)
+        with ost_export.ZipEmlWriter(self.path, spool_size=4096) as writer:
+            writer.write('large.eml', make_message('large', attachment))
+
+        with zipfile.ZipFile(self.path) as archive:
+            data = archive.read('large.eml')
+        self.assertIn(b'Subject: large', data)
+        self.assertGreater(len(data), 57 * 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()